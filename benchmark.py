@@ -0,0 +1,160 @@
+import os
+import time
+import argparse
+import tempfile
+import shapely
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import Polygon
+from bldg_regularization import (CRITERIA, SEARCHES, SWEEPS, clean_geoms, criterion_alphas, group_geoms, iou,
+                                 load_shp, prepare_groups, process_overlap, read_dataset, records_to_gdf,
+                                 regularize_geom, search_group, write_dataset)
+
+SHAPES = ['rectangle', 'L', 'T', 'U', 'noisy', 'row']
+FORMATS = {'shp': '.shp', 'gpkg': '.gpkg', 'parquet': '.parquet', 'arrow': '.arrow'}
+
+
+def outline(kind, w, h, t):
+    if kind == 'L':
+        return [(0, 0), (w, 0), (w, t), (t, t), (t, h), (0, h)]
+    elif kind == 'T':
+        return [(0, h - t), (0, h), (w, h), (w, h - t), (w / 2 + t / 2, h - t), (w / 2 + t / 2, 0),
+                (w / 2 - t / 2, 0), (w / 2 - t / 2, h - t)]
+    elif kind == 'U':
+        return [(0, 0), (w, 0), (w, h), (w - t, h), (w - t, t), (t, t), (t, h), (0, h)]
+    else:
+        return [(0, 0), (w, 0), (w, h), (0, h)]
+
+
+def densify(coords, density, noise, rng):
+    coords = np.array(coords + coords[:1], dtype=float)
+    steps = np.linspace(0, 1, density, endpoint=False)[:, np.newaxis]
+    dense = np.concatenate([coords[i] + steps * (coords[i + 1] - coords[i]) for i in range(len(coords) - 1)])
+    return dense + rng.normal(0, noise, dense.shape)
+
+
+def place(coords, deg, origin, center):
+    rad = np.deg2rad(deg)
+    mat = np.array([[np.cos(rad), - np.sin(rad)], [np.sin(rad), np.cos(rad)]])
+    return (coords - center) @ mat.T + origin
+
+
+def synthetic_footprints(count=1000, density=4, noise=0.1, seed=0, cell=60.0):
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(count)))
+    geoms, k = [], 0
+
+    while len(geoms) < count:
+        kind = SHAPES[k % len(SHAPES)]
+        origin = np.array([k % side, k // side]) * cell + cell / 2
+        deg = rng.uniform(0, 180)
+        w, h = rng.uniform(10, 25, 2)
+        t = rng.uniform(0.3, 0.45) * min(w, h)
+
+        if kind == 'row':
+            w = w / 2
+            coords = [densify(outline(kind, w, h, t), density, noise, rng) + [i * w, 0]
+                      for i in range(rng.integers(3, 7))]
+            center = np.concatenate(coords).mean(axis=0)
+        else:
+            coords = [densify(outline(kind, w, h, t), density, noise * (4 if kind == 'noisy' else 1), rng)]
+            center = coords[0].mean(axis=0)
+
+        parts = [place(item, deg, origin, center) for item in coords]
+
+        for part in parts:
+            geom = Polygon(part)
+            geoms.append(geom if geom.is_valid else shapely.make_valid(geom).buffer(0))
+
+        k += 1
+
+    return geoms[:count]
+
+
+def benchmark(in_fp, lod=1, criterion='Min bounding', simplify=0.5, **options):
+    alphas = criterion_alphas(criterion)
+    timings = {}
+
+    time_start = time.perf_counter()
+    poly_list, poly_source, poly_num, gdf = load_shp(in_fp, True, simplify)
+    timings['load_shp'] = time.perf_counter() - time_start
+
+    time_start = time.perf_counter()
+    gdf = read_dataset(in_fp, columns=[])
+    timings['read'] = time.perf_counter() - time_start
+
+    time_start = time.perf_counter()
+    geom_list = clean_geoms(gdf.geometry.values)[0]
+    groups = group_geoms(geom_list)
+    timings['grouping'] = time.perf_counter() - time_start
+
+    time_start = time.perf_counter()
+    poly_list = prepare_groups(geom_list, simplify=simplify, groups=groups)[0]
+    timings['simplify'] = time.perf_counter() - time_start
+
+    time_start = time.perf_counter()
+    regularize_geom([geom for poly in poly_list for geom in poly], lod=lod, alphas=alphas)
+    timings['regularize_geom'] = time.perf_counter() - time_start
+
+    records, timings['sweep'], timings['process_overlap'] = [], 0.0, 0.0
+
+    for group_id, poly in enumerate(poly_list):
+        time_start = time.perf_counter()
+        poly_reg, deg, factors, _ = search_group(poly, lod=lod, alphas=alphas, **options)
+        timings['sweep'] += time.perf_counter() - time_start
+
+        time_start = time.perf_counter()
+        poly_clean = process_overlap(poly_reg)
+        timings['process_overlap'] += time.perf_counter() - time_start
+
+        for i, value in enumerate(iou(poly, poly_clean)):
+            records.append({'Poly_ID': len(records), 'Group_ID': group_id, 'IOU': value, 'Direction': deg,
+                            'Factor': factors[i], 'geometry': poly_clean[i]})
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        time_start = time.perf_counter()
+        write_dataset(records_to_gdf(records, gdf.crs), os.path.join(temp_dir, 'out' + os.path.splitext(in_fp)[1]))
+        timings['write'] = time.perf_counter() - time_start
+
+    return {'lod': lod, 'criterion': criterion, 'polygons': poly_num, 'groups': len(groups),
+            'vertices': int(np.sum(shapely.get_num_coordinates(geom_list))), **timings,
+            'mean_iou': np.mean([record['IOU'] for record in records])}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time each regularization stage on synthetic footprints.')
+    parser.add_argument('--count', type=int, default=200, help='number of synthetic footprints (default: 200)')
+    parser.add_argument('--density', type=int, default=4, help='vertices per outline edge (default: 4)')
+    parser.add_argument('--noise', type=float, default=0.1, help='vertex noise standard deviation (default: 0.1)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the generator (default: 0)')
+    parser.add_argument('--lod', type=int, nargs='+', choices=[1, 2, 3], default=[1, 2, 3])
+    parser.add_argument('--criterion', nargs='+', choices=list(CRITERIA), default=list(CRITERIA))
+    parser.add_argument('--sweep', choices=list(SWEEPS), default='vectorized')
+    parser.add_argument('--search', choices=SEARCHES, default='exhaustive')
+    parser.add_argument('--simplify', type=float, default=0.5)
+    parser.add_argument('--format', choices=list(FORMATS), default='shp', help='file format of the input and output')
+    parser.add_argument('--csv', help='also write the results to this csv file')
+    args = parser.parse_args(argv)
+
+    geoms = synthetic_footprints(args.count, args.density, args.noise, args.seed)
+    results = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        in_fp = os.path.join(temp_dir, 'synthetic' + FORMATS[args.format])
+        write_dataset(gpd.GeoDataFrame(geometry=geoms, crs=3857), in_fp)
+
+        for lod in args.lod:
+            for criterion in args.criterion:
+                results.append(benchmark(in_fp, lod=lod, criterion=criterion, simplify=args.simplify,
+                                         sweep=args.sweep, search=args.search))
+
+    df = pd.DataFrame(results)
+    print(df.to_string(index=False, float_format=lambda x: f'{x:.4f}'))
+
+    if args.csv:
+        df.to_csv(args.csv, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import shapely
+
+CACHE_VERSION = 1
+
+
+def digest(poly, params, prefix=''):
+    h = hashlib.sha256(prefix.encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+
+    for wkb in shapely.to_wkb(poly):
+        h.update(len(wkb).to_bytes(8, 'little'))
+        h.update(wkb)
+
+    return h.hexdigest()
+
+
+def encode_result(result):
+    poly_clean, IOUs, deg, factors = result
+    return json.dumps({'geoms': [item.hex() for item in shapely.to_wkb(poly_clean)],
+                       'iou': [float(item) for item in IOUs], 'deg': float(deg),
+                       'factor': [float(item) for item in factors]}).encode()
+
+
+def decode_result(value):
+    value = json.loads(value)
+    return list(shapely.from_wkb(value['geoms'])), value['iou'], value['deg'], value['factor']
+
+
+class ResultCache:
+    def __init__(self, path, max_bytes=1 << 30, version=''):
+        self.path, self.max_bytes = path, max_bytes
+        self.version = f'{CACHE_VERSION}:{version}'
+        self.hits, self.misses, self.pending, self.pinned = 0, 0, 0, set()
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS results '
+                          '(key TEXT PRIMARY KEY, value BLOB, size INTEGER, used REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+
+        if row is None or row[0] != self.version:
+            self.invalidate()
+
+        self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        self.evict()
+        self.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def key(self, poly, params):
+        return digest(poly, params, self.version)
+
+    def contains(self, key):
+        return self.conn.execute('SELECT 1 FROM results WHERE key = ?', (key,)).fetchone() is not None
+
+    def get(self, key):
+        row = self.conn.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        self.hits += 1
+        self.conn.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        self.commit_later()
+        return decode_result(row[0])
+
+    def put(self, key, result):
+        self.misses += 1
+        value = encode_result(result)
+        old = self.conn.execute('SELECT size FROM results WHERE key = ?', (key,)).fetchone()
+        self.conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, value, len(value), time.time()))
+        self.size += len(value) - (old[0] if old else 0)
+        self.evict()
+        self.commit_later()
+
+    def evict(self):
+        if self.size <= self.max_bytes:
+            return
+
+        victims = []
+
+        for key, size in self.conn.execute('SELECT key, size FROM results ORDER BY used'):
+            if key not in self.pinned:
+                victims.append((key,))
+                self.size -= size
+
+                if self.size <= self.max_bytes:
+                    break
+
+        self.conn.executemany('DELETE FROM results WHERE key = ?', victims)
+
+    def invalidate(self):
+        self.conn.execute('DELETE FROM results')
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+        self.conn.commit()
+        self.size = 0
+
+    def commit_later(self, every=256):
+        self.pending += 1
+
+        if self.pending >= every:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+
+class Journal:
+    def __init__(self, path, fingerprint, resume=False, interval=30.0):
+        self.path, self.interval, self.committed = path, interval, time.time()
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS groups (id INTEGER PRIMARY KEY, value BLOB)')
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'fingerprint'").fetchone()
+
+        if resume and row is None:
+            self.conn.close()
+            raise ValueError(f'No checkpoint to resume in {path}')
+        elif resume and row[0] != fingerprint:
+            self.conn.close()
+            raise ValueError(f'The input or parameters changed since the checkpoint in {path} was written')
+        elif not resume:
+            self.conn.execute('DELETE FROM groups')
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+            self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def completed(self):
+        return {row[0] for row in self.conn.execute('SELECT id FROM groups')}
+
+    def get(self, group_id):
+        return decode_result(self.conn.execute('SELECT value FROM groups WHERE id = ?', (group_id,)).fetchone()[0])
+
+    def put(self, group_id, result):
+        self.conn.execute('INSERT OR REPLACE INTO groups VALUES (?, ?)', (group_id, encode_result(result)))
+
+        if time.time() - self.committed >= self.interval:
+            self.commit()
+
+    def commit(self):
+        self.conn.commit()
+        self.committed = time.time()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+    def remove(self):
+        self.conn.close()
+
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
@@ -1,9 +1,18 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import functools
+import collections
+from concurrent.futures import ProcessPoolExecutor
 import shapely
 import numpy as np
+import pandas as pd
+import pyogrio
 import geopandas as gpd
-import matplotlib.pyplot as plt
-from shapely.geometry import Polygon
 from shapely.validation import make_valid
+from bldg_cache import Journal, ResultCache, digest
 
 
 def rotate_geom(geoms, centroids, deg):
@@ -15,24 +24,30 @@ def rotate_geom(geoms, centroids, deg):
     return results
 
 
+def rotation_matrix(degs):
+    rad = np.deg2rad(degs)
+    cos, sin = np.cos(rad), np.sin(rad)
+    return np.stack([np.stack([cos, - sin], axis=-1), np.stack([sin, cos], axis=-1)], axis=-2)
+
+
 def intersect_line(sp, vec):
-    sa, sb = sp[:- 1], sp[:- 1] + vec[:- 1]
-    sc, sd = sp[1:], sp[1:] + vec[1:]
+    sa, sb = sp[..., :- 1, :], sp[..., :- 1, :] + vec[..., :- 1, :]
+    sc, sd = sp[..., 1:, :], sp[..., 1:, :] + vec[..., 1:, :]
 
-    a1 = sb[:, 1] - sa[:, 1]
-    b1 = sa[:, 0] - sb[:, 0]
-    c1 = a1 * sa[:, 0] + b1 * sa[:, 1]
+    a1 = sb[..., 1] - sa[..., 1]
+    b1 = sa[..., 0] - sb[..., 0]
+    c1 = a1 * sa[..., 0] + b1 * sa[..., 1]
 
-    a2 = sd[:, 1] - sc[:, 1]
-    b2 = sc[:, 0] - sd[:, 0]
-    c2 = a2 * sc[:, 0] + b2 * sc[:, 1]
+    a2 = sd[..., 1] - sc[..., 1]
+    b2 = sc[..., 0] - sd[..., 0]
+    c2 = a2 * sc[..., 0] + b2 * sc[..., 1]
     det = a1 * b2 - a2 * b1
     with np.errstate(divide='ignore', invalid='ignore'):
-        return np.array([(b2 * c1 - b1 * c2) / det, (a1 * c2 - a2 * c1) / det]).T
+        return np.stack([(b2 * c1 - b1 * c2) / det, (a1 * c2 - a2 * c1) / det], axis=-1)
 
 
-def regularize_geom(geoms, lod=1, alphas=None):
-    geom_out, iou_out, alpha_out = [], [], []
+@functools.lru_cache(maxsize=None)
+def direction_vectors(lod=1):
     vecs = [[np.cos(0), np.sin(0)], [np.cos(np.pi / 2), np.sin(np.pi / 2)]]
 
     for i in range(1, lod):
@@ -43,50 +58,240 @@ def regularize_geom(geoms, lod=1, alphas=None):
             vecs.append([np.cos(np.deg2rad(sep * (j + 1) + 90)), np.sin(np.deg2rad(sep * (j + 1) + 90))])
 
     vecs = np.array(vecs)
+    vecs.flags.writeable = False
+    return vecs
+
 
-    for geom in geoms:
-        geom_temp, iou_temp = [], []
+def regularize_geom(geoms, lod=1, alphas=None):
+    coords, offsets = ring_buffer(geoms)
+    pts, ids = regularize_buffer(coords[np.newaxis], offsets, direction_vectors(lod), alphas)
+    ids = (np.arange(len(alphas))[:, np.newaxis] * len(geoms) + ids).ravel()
+    geom_temp = shapely.polygons(shapely.linearrings(pts.reshape(- 1, 2), indices=ids))
+    invalid = ~shapely.is_valid(geom_temp)
+    geom_temp[invalid] = [fix_invalid(item) for item in geom_temp[invalid]]
+    geom_temp = geom_temp.reshape(len(alphas), len(geoms))
 
-        for alpha in alphas:
-            geom_np_new = []
-            geom_np = np.array(geom.exterior.coords[:])
-            lines = np.array([[geom_np[i], geom_np[i + 1]] for i in range(len(geom_np) - 1)])
-            edge_sp, edge_vec, line_cls = project_line(lines, vecs, alpha)
-            edge_sp = np.append(edge_sp, [edge_sp[0]], axis=0)
-            edge_vec = np.append(edge_vec, [edge_vec[0]], axis=0)
-            line_cls = np.append(line_cls, [line_cls[0]], axis=0)
-            lines = np.append(lines, [lines[0]], axis=0)
+    iou_temp = iou(geom_temp, np.array(geoms, dtype=object))
+    idx = np.argmax(iou_temp, axis=0)
+    geom_out = list(geom_temp[idx, np.arange(len(geoms))])
+    iou_out = list(iou_temp[idx, np.arange(len(geoms))])
+    alpha_out = [alphas[item] for item in idx]
 
-            pns = intersect_line(edge_sp, edge_vec)
-            pas = project_point(edge_sp[:- 1], edge_vec[:- 1], lines[:-1, 1, :])
-            pbs = project_point(edge_sp[1:], edge_vec[1:], lines[:-1, 1, :])
+    return geom_out, iou_out, alpha_out
 
-            for i in range(len(edge_sp) - 1):
 
-                if line_cls[i] != line_cls[i + 1]:
-                    geom_np_new.append(pns[i])
-                else:
-                    geom_np_new.append(pas[i])
-                    geom_np_new.append(pbs[i])
+def ring_buffer(geoms):
+    coords, index = shapely.get_coordinates(shapely.get_exterior_ring(geoms), return_index=True)
+    return coords, np.searchsorted(index, np.arange(len(geoms) + 1))
 
-            geom_np_new.append(geom_np_new[0])
-            geom_np_new = np.array(geom_np_new)
-            geom_new = fix_invalid(Polygon(geom_np_new))
-            iou = geom_new.intersection(geom).area / geom_new.union(geom).area
-            geom_temp.append(geom_new)
-            iou_temp.append(iou)
 
-        idx = np.argmax(iou_temp)
-        alpha_out.append(alphas[idx])
-        iou_out.append(iou_temp[idx])
-        geom_out.append(geom_temp[idx])
+def regularize_buffer(coords, offsets, vecs, alphas):
+    sizes = np.diff(offsets) - 1
+    edge_offsets = np.concatenate([[0], np.cumsum(sizes)])
+    start = np.delete(np.arange(coords.shape[1]), offsets[1:] - 1)
+    nxt = np.arange(1, len(start) + 1)
+    nxt[edge_offsets[1:] - 1] = edge_offsets[:- 1]
+
+    lines = np.stack([coords[:, start], coords[:, start + 1]], axis=-2)
+    lrs = np.reshape(alphas, (- 1,) + (1,) * coords.ndim)
+    edge_sp, edge_vec, line_cls = project_line(lines, vecs, lrs)
+    pair_sp = np.stack([edge_sp, edge_sp[..., nxt, :]], axis=-2)
+    pair_vec = np.stack([edge_vec, edge_vec[:, nxt]], axis=-2)
+    corner = line_cls != line_cls[:, nxt]
+
+    pns = intersect_line(pair_sp, pair_vec)[..., 0, :]
+    pas = project_point(edge_sp, edge_vec, lines[:, :, 1])
+    pbs = project_point(pair_sp[..., 1, :], pair_vec[..., 1, :], lines[:, :, 1])
+
+    pts = np.stack([np.where(corner[..., np.newaxis], pns, pas), pbs], axis=-2)
+    keep = np.stack([np.ones_like(corner), ~corner], axis=-1)
+    ring_ids = np.arange(len(coords))[:, np.newaxis] * len(sizes) + np.repeat(np.arange(len(sizes)), sizes)
+    ring_ids = np.broadcast_to(ring_ids[..., np.newaxis], keep.shape)
+    return pts[:, keep], ring_ids[keep]
+
+
+def sweep_candidates(poly, mats, vecs, alphas):
+    coords, offsets = ring_buffer(poly)
+    centroids = shapely.get_coordinates(shapely.centroid(poly))
+    coords = np.einsum('aij,nj->ani', mats, coords - np.repeat(centroids, np.diff(offsets), axis=0))
+    pts, ids = regularize_buffer(coords, offsets, vecs, alphas)
+    pts = np.einsum('kji,akj->aki', mats[ids // len(poly)], pts) + centroids[ids % len(poly)]
+    ids = (np.arange(len(alphas))[:, np.newaxis] * len(mats) * len(poly) + ids).ravel()
+    geom_temp = shapely.polygons(shapely.linearrings(pts.reshape(- 1, 2), indices=ids))
+    invalid = ~shapely.is_valid(geom_temp)
+    geom_temp[invalid] = [fix_invalid(item) for item in geom_temp[invalid]]
+    return geom_temp.reshape(len(alphas), len(mats), len(poly)).transpose(2, 0, 1)
+
+
+def angle_batch(poly, alphas, batch=30, max_points=1000000):
+    vertices = int(np.sum(shapely.get_num_coordinates(poly)))
+    return max(1, min(batch, max_points // (4 * len(alphas) * vertices)))
+
+
+def sweep_group(poly, lod=1, alphas=None, degs=None, batch=30, max_points=1000000):
+    alphas = CRITERIA['Min bounding'] if alphas is None else alphas
+    degs = np.arange(180) if degs is None else np.asarray(degs)
+    vecs = direction_vectors(lod)
+    sources = np.array(poly, dtype=object)[:, np.newaxis, np.newaxis]
+    batch = angle_batch(poly, alphas, batch, max_points)
+    best_iou, best = - np.inf, None
+
+    for start in range(0, len(degs), batch):
+        deg_batch = degs[start:start + batch]
+        mats = rotation_matrix(deg_batch)
+        geom_temp = sweep_candidates(poly, mats, vecs, alphas)
+        iou_temp = iou(geom_temp, sources)
+        idx = np.argmax(iou_temp, axis=1)
+        IOUs = np.take_along_axis(iou_temp, idx[:, np.newaxis], axis=1)[:, 0].mean(axis=0)
+        bid = np.flatnonzero(IOUs >= IOUs.max() - IOU_TOL)[0]
+
+        if IOUs[bid] > best_iou + IOU_TOL:
+            best_iou = IOUs[bid]
+            best = (list(geom_temp[np.arange(len(poly)), idx[:, bid], bid]), deg_batch[bid].item(),
+                    [alphas[item] for item in idx[:, bid]], best_iou)
+
+    return best
+
+
+def sweep_group_shapely(poly, lod=1, alphas=None, degs=None):
+    alphas = CRITERIA['Min bounding'] if alphas is None else alphas
+    degs = [item for item in range(180)] if degs is None else degs
+    IOUs, poly_regs, alpha_temp = [], [], []
+    centroid = shapely.centroid(poly)
+
+    for deg in degs:
+        poly_rotate = rotate_geom(poly, centroid, deg)
+        poly_reg, IOU, alpha = regularize_geom(poly_rotate, lod=lod, alphas=alphas)
+        poly_reg = rotate_geom(poly_reg, centroid, - deg)
+
+        IOUs.append(np.mean(IOU))
+        poly_regs.append(poly_reg)
+        alpha_temp.append(alpha)
+
+    bid = np.argmax(IOUs)
+    return poly_regs[bid], degs[bid], alpha_temp[bid], IOUs[bid]
+
+
+def dominant_directions(poly, peaks=2, period=90):
+    line_vec = np.concatenate([np.diff(np.array(geom.exterior.coords), axis=0) for geom in poly])
+    weights = np.linalg.norm(line_vec, axis=1)
+    degs = np.mod(- np.rad2deg(np.arctan2(line_vec[:, 1], line_vec[:, 0])), period)
+    hist = np.bincount(np.floor(degs).astype(int) % period, weights=weights, minlength=period)
+    hist = hist + np.roll(hist, 1) + np.roll(hist, - 1)
+    ids = np.flatnonzero((hist >= np.roll(hist, 1)) & (hist > np.roll(hist, - 1)))
+    ids = ids[np.argsort(- hist[ids], kind='stable')][:peaks] if len(ids) else [np.argmax(hist)]
+    centers = []
+
+    for idx in ids:
+        offset = np.mod(degs - idx + period / 2, period) - period / 2
+        near = np.abs(offset - 0.5) <= 1.5
+        centers.append(np.mod(idx + np.average(offset[near], weights=weights[near]), period))
+
+    return np.array(centers)
+
+
+def direction_classes(lod=1, period=90):
+    vecs = direction_vectors(lod)
+    return np.unique(np.round(np.mod(np.rad2deg(np.arctan2(vecs[:, 1], vecs[:, 0])), period), 6))
 
-    return geom_out, iou_out, alpha_out
+
+def refine_group(poly, lod=1, alphas=None, sweep=None, peaks=2, tolerance=2.0, precision=0.1, period=90):
+    sweep = sweep_group if sweep is None else sweep
+    centers = dominant_directions(poly, peaks=peaks, period=period)
+    centers = np.mod(centers[:, np.newaxis] + direction_classes(lod, period), period).ravel()
+    offsets = np.arange(- np.floor(tolerance), np.floor(tolerance) + 1)
+    degs = np.unique(np.round(np.mod(centers[:, np.newaxis] + offsets, period), 6))
+    best = sweep(poly, lod=lod, alphas=alphas, degs=degs)
+    step = 1.0
+
+    while step > precision:
+        step_new = max(step / 4, precision)
+        offsets = np.arange(- step, step + step_new / 2, step_new)
+        degs = np.unique(np.round(np.mod(best[1] + offsets, period), 6))
+        result = sweep(poly, lod=lod, alphas=alphas, degs=degs)
+
+        if result[3] > best[3] + IOU_TOL:
+            best = result
+
+        step = step_new
+
+    return best
+
+
+def rectangle_direction(poly, period=90):
+    coords = shapely.get_coordinates(shapely.minimum_rotated_rectangle(shapely.multipolygons(poly)))
+    line_vec = coords[1] - coords[0] if len(coords) > 1 else np.zeros(2)
+    return np.mod(- np.rad2deg(np.arctan2(line_vec[1], line_vec[0])), period)
+
+
+def iou_bound(geoms, areas, bounds):
+    geom_areas, geom_bounds = shapely.area(geoms), shapely.bounds(geoms)
+    size = np.minimum(geom_bounds[..., 2:], bounds[..., 2:]) - np.maximum(geom_bounds[..., :2], bounds[..., :2])
+    inter = np.minimum(np.minimum(geom_areas, areas), np.prod(np.clip(size, 0, None), axis=-1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.nan_to_num(inter / (geom_areas + areas - inter), nan=1.0)
+
+
+def bound_group(poly, lod=1, alphas=None, degs=None, slack=0.0, batch=30, max_points=1000000, period=90):
+    alphas = CRITERIA['Min bounding'] if alphas is None else alphas
+    degs = np.arange(180) if degs is None else np.asarray(degs)
+    vecs = direction_vectors(lod)
+    sources = np.array(poly, dtype=object)[:, np.newaxis, np.newaxis]
+    areas, bounds = shapely.area(sources), shapely.bounds(sources)
+    first = int(np.argmin(np.abs(np.asarray(alphas) - 0.5)))
+    distance = np.abs(np.mod(degs - rectangle_direction(poly, period) + period / 2, period) - period / 2)
+    order = np.argsort(distance, kind='stable')
+    batch = angle_batch(poly, alphas, batch, max_points)
+    IOUs, kept, pruned = np.full(len(degs), - np.inf), {}, 0
+    best_iou = - np.inf
+
+    for start in range(0, len(degs), batch):
+        ids = order[start:start + batch]
+        geom_temp = sweep_candidates(poly, rotation_matrix(degs[ids]), vecs, alphas)
+        upper = iou_bound(geom_temp, areas, bounds)
+        live = upper.max(axis=1).mean(axis=0) >= best_iou - IOU_TOL + slack
+        iou_temp = np.full(upper.shape, - np.inf)
+        iou_temp[:, first, live] = iou(geom_temp[:, first, live], sources[:, 0])
+        rest = live & (upper >= iou_temp[:, [first]] - IOU_TOL)
+        rest[:, first] = False
+        iou_temp[rest] = iou(geom_temp[rest], np.broadcast_to(sources, rest.shape)[rest])
+        pruned += int(upper.size - live.sum() * len(poly) - rest.sum())
+
+        idx = np.argmax(iou_temp, axis=1)
+        values = np.take_along_axis(iou_temp, idx[:, np.newaxis], axis=1)[:, 0].mean(axis=0)
+        IOUs[ids[live]] = values[live]
+        best_iou = max(best_iou, values.max())
+
+        for k in np.flatnonzero(live & (values >= best_iou - 2 * IOU_TOL)):
+            kept[ids[k]] = (list(geom_temp[np.arange(len(poly)), idx[:, k], k]), [alphas[item] for item in idx[:, k]])
+
+    if PROFILE is not None:
+        PROFILE.counters['candidates'] += len(degs) * len(alphas) * len(poly)
+        PROFILE.counters['pruned'] += pruned
+
+    best_iou, bid = - np.inf, None
+
+    for start in range(0, len(degs), batch):
+        values = IOUs[start:start + batch]
+        k = start + np.flatnonzero(values >= values.max() - IOU_TOL)[0]
+
+        if IOUs[k] > best_iou + IOU_TOL:
+            best_iou, bid = IOUs[k], k
+
+    return kept[bid][0], degs[bid].item(), kept[bid][1], best_iou
+
+
+def iou(geoms_a, geoms_b):
+    inter = shapely.area(shapely.intersection(geoms_a, geoms_b))
+    return inter / (shapely.area(geoms_a) + shapely.area(geoms_b) - inter)
 
 
 def fix_invalid(geom):
 
     if not geom.is_valid:
+        if PROFILE is not None:
+            PROFILE.counters['make_valid'] += 1
+
         geom_valid = make_valid(geom)
         items, areas = [], []
 
@@ -107,107 +312,828 @@ def fix_invalid(geom):
 
 
 def project_point(ls, ln, p):
-    return ls + np.multiply(ln, np.einsum('ij,ij->i', p - ls, ln)[:, np.newaxis])
+    return ls + np.multiply(ln, np.einsum('...j,...j->...', p - ls, ln)[..., np.newaxis])
 
 
 def project_line(lines, vecs, lr=0.5):
-    line_vec = lines[:, 1, :] - lines[:, 0, :]
+    line_vec = lines[..., 1, :] - lines[..., 0, :]
     line_cls = classify_line(line_vec, vecs)
-    pps = project_point(lines[:, 0], vecs[line_cls], lines[:, 1])
-    dets = ((lines[:, 1, 0] - lines[:, 0, 0]) * (pps[:, 1] - lines[:, 0, 1]) -
-            (lines[:, 1, 1] - lines[:, 0, 1]) * (pps[:, 0] - lines[:, 0, 0]))
-    spr = lines[:, 0] + lr * (lines[:, 1] - lines[:, 0])
-    spl = lines[:, 1] + lr * (lines[:, 0] - lines[:, 1])
-    sps = np.where(dets.reshape(-1, 1) > 0, spr, spl)
+    pps = project_point(lines[..., 0, :], vecs[line_cls], lines[..., 1, :])
+    dets = ((lines[..., 1, 0] - lines[..., 0, 0]) * (pps[..., 1] - lines[..., 0, 1]) -
+            (lines[..., 1, 1] - lines[..., 0, 1]) * (pps[..., 0] - lines[..., 0, 0]))
+    spr = lines[..., 0, :] + lr * (lines[..., 1, :] - lines[..., 0, :])
+    spl = lines[..., 1, :] + lr * (lines[..., 0, :] - lines[..., 1, :])
+    sps = np.where(dets[..., np.newaxis] > 0, spr, spl)
     return sps, vecs[line_cls], line_cls
 
 
 def classify_line(line_vec, edge_vec):
     dets = line_vec @ edge_vec.T
-    angles = np.arccos(np.clip(dets / np.linalg.norm(line_vec, axis=1).reshape(-1, 1), - 1.0, 1.0))
+    angles = np.arccos(np.clip(dets / np.linalg.norm(line_vec, axis=-1)[..., np.newaxis], - 1.0, 1.0))
     degrees = np.rad2deg(np.where(dets < 0, np.pi - angles, angles))
-    return np.argmin(degrees, axis=1)
+    return np.argmin(degrees, axis=-1)
 
 
 def process_overlap(geoms):
     if len(geoms) > 1:
-        areas = [geom.area for geom in geoms]
+        areas = shapely.area(geoms)
         ids = np.argsort(areas)
+        ranks = np.argsort(ids)
+        tree = shapely.STRtree(geoms)
 
         for i in ids:
-            for j in [item for item in ids if item != i]:
+            items = tree.query(geoms[i])
+            items = items[items != i]
+            items = items[np.argsort(ranks[items])]
+
+            for j in items:
                 if geoms[i].intersects(geoms[j]):
                     geoms[i] = geoms[i].difference(geoms[j])
 
     return geoms
 
 
+def group_geoms(geoms):
+    if len(geoms) == 0:
+        return []
+
+    parent = np.arange(len(geoms))
+    pairs = shapely.STRtree(geoms).query(geoms, predicate='intersects')
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs[:, pairs[0] < pairs[1]].T:
+        root_i, root_j = find(i), find(j)
+
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    roots = np.array([find(i) for i in range(len(geoms))], dtype=int)
+    order = np.argsort(roots, kind='stable')
+    return np.split(order, np.flatnonzero(np.diff(roots[order])) + 1)
+
+
+def group_stats(sizes):
+    sizes = np.asarray(sizes)
+
+    if len(sizes) == 0:
+        return {'groups': 0, 'singletons': 0, 'min': 0, 'max': 0, 'mean': 0.0, 'p99': 0.0}
+
+    return {'groups': len(sizes), 'singletons': int(np.sum(sizes == 1)), 'min': int(sizes.min()),
+            'max': int(sizes.max()), 'mean': float(sizes.mean()), 'p99': float(np.percentile(sizes, 99))}
+
+
+def clean_geoms(geoms):
+    geoms = np.asarray(geoms, dtype=object)
+    types, parts = shapely.get_type_id(geoms), shapely.get_num_geometries(geoms)
+    multi = types == shapely.GeometryType.MULTIPOLYGON
+    geoms = np.where(multi & (parts == 1), shapely.get_geometry(geoms, 0), geoms)
+    multipart = multi & (parts > 1)
+    other = (types >= 0) & (types != shapely.GeometryType.POLYGON) & ~multi
+    valid = (shapely.get_type_id(geoms) == shapely.GeometryType.POLYGON) & (shapely.area(geoms) > 0)
+    dropped = {'multi-part': int(np.sum(multipart)), 'not polygonal': int(np.sum(other)),
+               'empty or degenerate': int(np.sum(~valid & ~multipart & ~other))}
+    kept = np.flatnonzero(valid)
+    geoms = geoms[kept]
+    invalid = ~shapely.is_valid(geoms)
+    geoms[invalid] = [fix_invalid(item) for item in geoms[invalid]]
+    return geoms, kept, dropped
+
+
+def format_dropped(dropped):
+    return ', '.join(f'{count} {reason}' for reason, count in dropped.items() if count)
+
+
+def feature_groups(geoms, group=True):
+    return group_geoms(geoms) if group else list(np.arange(len(geoms))[:, np.newaxis])
+
+
+def prepare_groups(geom_list, group=True, simplify=0.5, groups=None):
+    geoms = np.asarray(geom_list, dtype=object)
+
+    if groups is None and not group:
+        simplified = shapely.simplify(geoms, simplify) if simplify > 0 else geoms
+        return list(simplified[:, np.newaxis]), geoms
+
+    groups = group_geoms(geoms) if groups is None else groups
+    sizes = [len(ids) for ids in groups]
+    sources = geoms[np.concatenate([np.empty(0, dtype=int)] + [np.asarray(ids, dtype=int) for ids in groups])]
+    simplified = shapely.simplify(sources, simplify) if simplify > 0 else sources
+    return np.split(simplified, np.cumsum(sizes)[:- 1]) if sizes else [], sources
+
+
+def geometry_column(fp):
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    if ARROW_FORMATS[os.path.splitext(fp)[1].lower()] == 'parquet':
+        schema = pyarrow.parquet.read_schema(fp)
+    else:
+        schema = pyarrow.ipc.open_file(fp).schema
+
+    return json.loads(schema.metadata[b'geo'])['primary_column']
+
+
+def read_dataset(fp, columns=None):
+    fmt = ARROW_FORMATS.get(os.path.splitext(fp)[1].lower())
+
+    if fmt is None:
+        return gpd.read_file(fp, columns=columns)
+
+    columns = None if columns is None else list(columns) + [geometry_column(fp)]
+    return gpd.read_parquet(fp, columns=columns) if fmt == 'parquet' else gpd.read_feather(fp, columns=columns)
+
+
+def write_dataset(gdf, fp):
+    fmt = ARROW_FORMATS.get(os.path.splitext(fp)[1].lower())
+
+    if fmt == 'parquet':
+        gdf.to_parquet(fp, index=False)
+    elif fmt == 'feather':
+        gdf.to_feather(fp, index=False)
+    else:
+        gdf.to_file(fp)
+
+
 def load_shp(in_fp, group=True, simplify=0.5):
-    gdf = gpd.read_file(in_fp)
-    geom_list, results, sources = [], [], []
+    gdf = read_dataset(in_fp, columns=[])
+    geoms, _, gdf.attrs['dropped'] = clean_geoms(gdf.geometry.values)
+    results, sources = prepare_groups(geoms, group, simplify)
+    return results, sources, len(geoms), gdf
+
+
+SWEEPS = {
+    'vectorized': sweep_group,
+    'shapely': sweep_group_shapely
+}
+CRITERIA = {
+    'Min bounding': [0],
+    'Max IOU': [0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7]
+}
+COLUMNS = ['Poly_ID', 'Group_ID', 'IOU', 'Direction', 'Factor']
+COLUMN_TYPES = {'Poly_ID': 'int64', 'Group_ID': 'int64', 'IOU': 'float64', 'Direction': 'float64', 'Factor': 'float64'}
+ARROW_FORMATS = {'.parquet': 'parquet', '.geoparquet': 'parquet', '.arrow': 'feather', '.feather': 'feather',
+                 '.ipc': 'feather'}
+SEARCHES = ['exhaustive', 'refine', 'bound']
+IOU_TOL = 1e-9
+
+
+PROFILE = None
+PROFILED = ['load_shp', 'group_geoms', 'search_group', 'sweep_candidates', 'iou_bound', 'regularize_geom',
+            'project_line', 'intersect_line', 'fix_invalid', 'iou', 'process_overlap']
 
-    for index, row in gdf.iterrows():
-        geom = row['geometry']
-        geom_list.append(geom)
 
-    if group:
-        union_geom = gdf.unary_union
-        unions = [geom for geom in union_geom.geoms]
+class Profile:
+    def __init__(self):
+        self.calls, self.seconds = collections.Counter(), collections.Counter()
+        self.counters, self.groups = collections.Counter(), []
 
-        for union in unions:
-            ids = np.where(union.intersects(geom_list) == True)[0]
+    def update(self, profile):
+        for name, item in profile['functions'].items():
+            self.calls[name] += item['calls']
+            self.seconds[name] += item['seconds']
 
-            for item in ids:
-                sources.append(geom_list[item])
+        self.counters.update(profile['counters'])
+        self.groups.extend(profile['groups'])
 
-            if simplify > 0:
-                results.append([geom_list[item].simplify(simplify) for item in ids])
-            else:
-                results.append([geom_list[item] for item in ids])
+    def to_dict(self):
+        return {'functions': {name: {'calls': self.calls[name], 'seconds': self.seconds[name]} for name in self.calls},
+                'counters': dict(self.counters), 'groups': self.groups}
+
+    def write(self, fp):
+        with open(fp, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def profiled(name, func):
+    def wrapper(*args, **kwargs):
+        time_start = time.perf_counter()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            PROFILE.calls[name] += 1
+            PROFILE.seconds[name] += time.perf_counter() - time_start
+
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def enable_profile():
+    global PROFILE
+    PROFILE = Profile()
+
+    for name in PROFILED:
+        if not hasattr(globals()[name], '__wrapped__'):
+            globals()[name] = profiled(name, globals()[name])
+
+    return PROFILE
+
+
+def disable_profile():
+    global PROFILE
+    profile, PROFILE = PROFILE, None
+
+    for name in PROFILED:
+        globals()[name] = getattr(globals()[name], '__wrapped__', globals()[name])
+
+    return profile
+
+
+def criterion_alphas(criterion):
+    if criterion not in CRITERIA:
+        raise ValueError(f'Unknown regularization criterion: {criterion}')
+
+    return CRITERIA[criterion]
+
+
+def search_group(poly, lod=1, alphas=None, degs=None, sweep='vectorized', search='exhaustive', slack=0.0,
+                 **refine):
+    if sweep not in SWEEPS:
+        raise ValueError(f'Unknown sweep mode: {sweep}')
+
+    if search == 'exhaustive':
+        return SWEEPS[sweep](poly, lod=lod, alphas=alphas, degs=degs)
+    elif search == 'refine':
+        return refine_group(poly, lod=lod, alphas=alphas, sweep=SWEEPS[sweep], **refine)
+    elif search == 'bound':
+        if sweep != 'vectorized':
+            raise ValueError('The bound search requires the vectorized sweep')
+
+        return bound_group(poly, lod=lod, alphas=alphas, degs=degs, slack=slack)
     else:
+        raise ValueError(f'Unknown search mode: {search}')
+
+
+def regularize_group(poly, lod=1, alphas=None, **options):
+    poly_reg, deg, factors, _ = search_group(poly, lod=lod, alphas=alphas, **options)
+    poly_clean = process_overlap(poly_reg)
+    IOU_final = list(iou(poly, poly_clean))
+
+    return poly_clean, IOU_final, round(float(deg), 6), factors
+
+
+def chunk_groups(poly_list, max_vertices=20000, max_groups=None):
+    max_groups = len(poly_list) if max_groups is None else max_groups
+    chunks, start, count = [], 0, 0
+
+    for i, poly in enumerate(poly_list):
+        count += int(np.sum(shapely.get_num_coordinates(poly)))
+
+        if count >= max_vertices or i + 1 - start >= max_groups:
+            chunks.append((start, i + 1))
+            start, count = i + 1, 0
+
+    if start < len(poly_list):
+        chunks.append((start, len(poly_list)))
+
+    return chunks
+
+
+def regularize_chunk(chunk, lod=1, alphas=None, profile=False, **options):
+    results = []
+
+    if profile:
+        enable_profile()
+
+    for wkbs in chunk:
+        time_start = time.perf_counter()
+        poly_clean, IOUs, deg, factors = regularize_group(list(shapely.from_wkb(wkbs)), lod=lod, alphas=alphas,
+                                                          **options)
+        results.append((shapely.to_wkb(poly_clean), IOUs, deg, factors, time.perf_counter() - time_start))
+
+    return results, disable_profile().to_dict() if profile else None
+
+
+def collect_chunk(future):
+    results, profile = future.result()
+
+    if profile is not None and PROFILE is not None:
+        PROFILE.update(profile)
+
+    return [((list(shapely.from_wkb(wkbs)), IOUs, deg, factors), seconds)
+            for wkbs, IOUs, deg, factors, seconds in results]
+
+
+def timed_group(poly, lod=1, alphas=None, **options):
+    time_start = time.perf_counter()
+    result = regularize_group(poly, lod=lod, alphas=alphas, **options)
+    return result, time.perf_counter() - time_start
+
+
+def iterate_groups(poly_list, lod=1, alphas=None, workers=1, max_vertices=20000, cache=None, cache_params=None,
+                   journal=None, **options):
+    if journal is not None:
+        found = journal.completed()
+        results = iterate_groups([poly for i, poly in enumerate(poly_list) if i not in found], lod=lod, alphas=alphas,
+                                 workers=workers, max_vertices=max_vertices, cache=cache, cache_params=cache_params,
+                                 **options)
+
+        try:
+            for i in range(len(poly_list)):
+                if i in found:
+                    time_start = time.perf_counter()
+                    yield journal.get(i), time.perf_counter() - time_start, 'journal'
+                else:
+                    result, seconds, source = next(results)
+                    journal.put(i, result)
+                    yield result, seconds, source
+        finally:
+            journal.commit()
+        return
+
+    if cache is not None:
+        params = dict(lod=lod, alphas=list(alphas), **options, **(cache_params or {}))
+        keys = [cache.key(poly, params) for poly in poly_list]
+        found = [cache.contains(key) for key in keys]
+        results = iterate_groups([poly for poly, hit in zip(poly_list, found) if not hit], lod=lod, alphas=alphas,
+                                 workers=workers, max_vertices=max_vertices, **options)
+
+        cache.pinned.update(key for key, hit in zip(keys, found) if hit)
+
+        try:
+            for poly, key, hit in zip(poly_list, keys, found):
+                time_start = time.perf_counter()
+                result = cache.get(key) if hit else None
+                seconds, source = time.perf_counter() - time_start, 'cache'
+
+                if result is None:
+                    if hit:
+                        result, seconds = timed_group(poly, lod=lod, alphas=alphas, **options)
+                        source = 'computed'
+                    else:
+                        result, seconds, source = next(results)
+
+                    cache.put(key, result)
+
+                cache.pinned.discard(key)
+                yield result, seconds, source
+        finally:
+            cache.pinned.clear()
+            cache.commit()
+        return
+
+    workers = os.cpu_count() if not workers else workers
+
+    if workers <= 1:
+        for poly in poly_list:
+            result, seconds = timed_group(poly, lod=lod, alphas=alphas, **options)
+            yield result, seconds, 'computed'
+        return
+
+    pending = collections.deque()
+    max_groups = max(1, int(np.ceil(len(poly_list) / (4 * workers))))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for start, stop in chunk_groups(poly_list, max_vertices, max_groups):
+            chunk = [shapely.to_wkb(poly) for poly in poly_list[start:stop]]
+            pending.append(executor.submit(regularize_chunk, chunk, lod=lod, alphas=alphas,
+                                           profile=PROFILE is not None, **options))
+
+            while len(pending) > 4 * workers or (pending and pending[0].done()):
+                for result, seconds in collect_chunk(pending.popleft()):
+                    yield result, seconds, 'computed'
+
+        while pending:
+            for result, seconds in collect_chunk(pending.popleft()):
+                yield result, seconds, 'computed'
+
+
+def regularize_groups(poly_list, poly_source, lod=1, criterion='Min bounding', first_poly=0, first_group=0,
+                      **options):
+    alphas = criterion_alphas(criterion)
+    poly_id = first_poly
+    results = iterate_groups(poly_list, lod, alphas, **options)
+
+    for group_id, poly in enumerate(poly_list, start=first_group):
+        (poly_clean, IOUs, deg, factors), seconds, source = next(results)
+
+        if PROFILE is not None:
+            PROFILE.groups.append({'Group_ID': group_id, 'members': len(poly),
+                                   'vertices': int(np.sum(shapely.get_num_coordinates(poly))), 'seconds': seconds,
+                                   'source': source})
+
+        for i in range(len(poly)):
+            yield {'Poly_ID': poly_id, 'Group_ID': group_id, 'IOU': IOUs[i], 'Direction': deg,
+                   'Factor': factors[i], 'geometry': poly_clean[i], 'simplified': poly[i],
+                   'source': poly_source[poly_id - first_poly]}
+            poly_id += 1
+
+    results.close()
+
+
+def records_to_gdf(records, crs=None):
+    df = pd.DataFrame({column: [record[column] for record in records] for column in COLUMNS}).astype(COLUMN_TYPES)
+    return gpd.GeoDataFrame(df, geometry=[record['geometry'] for record in records], crs=crs)
+
+
+def regularize_dataset(in_fp, out_fp=None, lod=1, criterion='Min bounding', group=True, simplify=0.5, cache=None,
+                       checkpoint=None, resume=False, checkpoint_interval=30.0, **options):
+    poly_list, poly_source, poly_num, gdf = load_shp(in_fp, group, simplify)
+    cache_params = {'simplify': simplify, 'group': group} if cache is not None else None
+    journal = None
+
+    if checkpoint:
+        params = dict(lod=lod, criterion=criterion, group=group, simplify=simplify,
+                      **{key: value for key, value in options.items() if key not in ['workers', 'max_vertices']})
+        journal = Journal(checkpoint, digest(poly_source, params), resume, checkpoint_interval)
+
+    try:
+        records = list(regularize_groups(poly_list, poly_source, lod=lod, criterion=criterion, cache=cache,
+                                         cache_params=cache_params, journal=journal, **options))
+    finally:
+        if journal is not None:
+            journal.close()
+
+    out_gdf = records_to_gdf(records, gdf.crs)
+    out_gdf.attrs['dropped'] = gdf.attrs['dropped']
+
+    if out_fp:
+        write_dataset(out_gdf, out_fp)
+
+    if journal is not None:
+        journal.remove()
+
+    return out_gdf
+
+
+def feature_hashes(geoms):
+    return [hashlib.sha256(wkb).hexdigest() for wkb in shapely.to_wkb(geoms)]
+
+
+def manifest_path(out_fp):
+    return os.path.splitext(out_fp)[0] + '_manifest.csv'
+
+
+def previous_hashes(previous, previous_input=None, group=True):
+    if os.path.exists(manifest_path(previous)):
+        manifest = pd.read_csv(manifest_path(previous))
+        return dict(zip(manifest['Poly_ID'], manifest['Hash']))
+
+    if previous_input is None:
+        raise ValueError(f'No manifest next to {previous}, the previous input is needed to match its features')
+
+    geoms = clean_geoms(read_dataset(previous_input, columns=[]).geometry.values)[0]
+    return dict(enumerate(feature_hashes(prepare_groups(geoms, group, 0)[1])))
+
+
+def regularize_incremental(in_fp, out_fp, previous, previous_input=None, lod=1, criterion='Min bounding', group=True,
+                           simplify=0.5, **options):
+    gdf = read_dataset(in_fp, columns=[])
+    geom_list, _, dropped = clean_geoms(gdf.geometry.values)
+    hashes = feature_hashes(geom_list)
+    prev_gdf = read_dataset(previous, columns=COLUMNS)
+    prev_gdf['Hash'] = prev_gdf['Poly_ID'].map(previous_hashes(previous, previous_input, group))
+
+    if prev_gdf['Hash'].isna().any():
+        raise ValueError(f'The features of {previous} do not match its manifest or previous input')
+
+    available = collections.defaultdict(collections.deque)
+    matched = np.full(len(hashes), - 1)
+
+    for k, item in enumerate(prev_gdf['Hash']):
+        available[item].append(k)
+
+    for i, item in enumerate(hashes):
+        if available[item]:
+            matched[i] = available[item].popleft()
+
+    prev_groups = prev_gdf['Group_ID'].to_numpy()
+    prev_sizes = collections.Counter(prev_groups)
+    carried, recompute = [], []
+
+    for members in feature_groups(geom_list, group):
+        rows = matched[members]
+
+        if np.all(rows >= 0) and len(set(prev_groups[rows])) == 1 and prev_sizes[prev_groups[rows[0]]] == len(rows):
+            carried.extend(rows)
+        else:
+            recompute.append(members)
+
+    ids = np.array([i for ids in recompute for i in ids], dtype=int)
+    poly_ids = prev_gdf['Poly_ID'].to_numpy()[matched[ids]]
+    added = matched[ids] < 0
+    next_poly = int(prev_gdf['Poly_ID'].max()) + 1 if len(prev_gdf) else 0
+    poly_ids[added] = np.arange(next_poly, next_poly + added.sum())
+    next_group = int(prev_gdf['Group_ID'].max()) + 1 if len(prev_gdf) else 0
+
+    poly_list, poly_source = prepare_groups(geom_list, simplify=simplify, groups=recompute)
+    records = list(regularize_groups(poly_list, poly_source, lod=lod, criterion=criterion, first_group=next_group,
+                                     **options))
+
+    for record, poly_id in zip(records, poly_ids):
+        record['Poly_ID'] = poly_id
+
+    new_gdf = records_to_gdf(records, gdf.crs).assign(Hash=[hashes[i] for i in ids])
+    out_gdf = pd.concat([prev_gdf.iloc[carried][COLUMNS + ['Hash', 'geometry']], new_gdf], ignore_index=True)
+    out_gdf = out_gdf.sort_values(['Group_ID', 'Poly_ID'], kind='stable').reset_index(drop=True)
+    stats = {'unchanged': int(np.sum(matched >= 0)), 'new': int(np.sum(matched < 0)),
+             'removed': len(prev_gdf) - int(np.sum(matched >= 0)), 'carried': len(set(prev_groups[carried])),
+             'recomputed': len(recompute)}
+
+    manifest = out_gdf[['Poly_ID', 'Hash']]
+    out_gdf = gpd.GeoDataFrame(out_gdf.drop(columns='Hash'), crs=gdf.crs)
+    out_gdf.attrs['dropped'] = dropped
+
+    if out_fp:
+        write_dataset(out_gdf, out_fp)
+        manifest.to_csv(manifest_path(out_fp), index=False)
+
+    return out_gdf, stats
+
+
+def summarize(out_gdf):
+    IOUs = out_gdf['IOU'].to_numpy()
+    empty = len(IOUs) == 0
+    return {'polygons': len(out_gdf), 'sizes': out_gdf.groupby('Group_ID').size().to_numpy(),
+            'iou_max': np.nan if empty else IOUs.max(), 'iou_min': np.nan if empty else IOUs.min(),
+            'iou_mean': np.nan if empty else IOUs.mean(), 'iou_std': np.nan if empty else IOUs.std(),
+            'dropped': out_gdf.attrs.get('dropped', {})}
+
+
+def regularize_stream(in_fp, out_fp, lod=1, criterion='Min bounding', group=True, simplify=0.5, chunk_size=10000,
+                      cache=None, **options):
+    poly_id, group_id, count, total, squares = 0, 0, 0, 0.0, 0.0
+    iou_min, iou_max, sizes, dropped = np.inf, - np.inf, collections.Counter(), collections.Counter()
+    cache_params = {'simplify': simplify, 'group': group} if cache is not None else None
+    require_ogr(in_fp, out_fp)
+    feature_num = pyogrio.read_info(in_fp)['features']
+
+    for skip in range(0, feature_num, chunk_size):
+        gdf = gpd.read_file(in_fp, rows=slice(skip, skip + chunk_size))
+        geom_list, _, dropped_chunk = clean_geoms(gdf.geometry.values)
+        dropped.update(dropped_chunk)
+        poly_list, poly_source = prepare_groups(geom_list, group, simplify)
+        records = list(regularize_groups(poly_list, poly_source, lod=lod, criterion=criterion, first_poly=poly_id,
+                                         first_group=group_id, cache=cache, cache_params=cache_params, **options))
+
+        if not records:
+            continue
+
+        out_gdf = records_to_gdf(records, gdf.crs)
+        out_gdf.to_file(out_fp, mode='a' if poly_id else 'w')
+        poly_id, group_id = poly_id + len(records), group_id + len(poly_list)
+        sizes.update(len(poly) for poly in poly_list)
+        count, total, squares = count + len(records), total + out_gdf['IOU'].sum(), squares + np.sum(out_gdf['IOU'] ** 2)
+        iou_min, iou_max = min(iou_min, out_gdf['IOU'].min()), max(iou_max, out_gdf['IOU'].max())
+
+    mean = total / count if count else np.nan
+    std = np.sqrt(max(squares / count - mean ** 2, 0)) if count else np.nan
+    return {'polygons': count, 'sizes': np.repeat(list(sizes.keys()), list(sizes.values())),
+            'iou_max': iou_max if count else np.nan, 'iou_min': iou_min if count else np.nan,
+            'iou_mean': mean, 'iou_std': std, 'dropped': dict(dropped)}
+
+
+def require_ogr(*fps):
+    for fp in fps:
+        if os.path.splitext(fp)[1].lower() in ARROW_FORMATS:
+            raise ValueError(f'Chunked and tiled processing read and write through OGR, {fp} is an Arrow file')
+
+
+def dataset_extent(in_fp):
+    return pyogrio.read_info(in_fp, force_total_bounds=True)['total_bounds']
+
+
+def partition_tiles(in_fp, tile_size, extent=None):
+    minx, miny, maxx, maxy = dataset_extent(in_fp) if extent is None else extent
+    nx, ny = int((maxx - minx) // tile_size) + 1, int((maxy - miny) // tile_size) + 1
+    return [(minx + i * tile_size, miny + j * tile_size, minx + (i + 1) * tile_size, miny + (j + 1) * tile_size)
+            for j in range(ny) for i in range(nx)]
+
+
+def regularize_tile(in_fp, tile, halo=100.0, lod=1, criterion='Min bounding', group=True, simplify=0.5, extent=None,
+                    **options):
+    extent = dataset_extent(in_fp) if extent is None else extent
+
+    while True:
+        window = (tile[0] - halo, tile[1] - halo, tile[2] + halo, tile[3] + halo)
+        covered = window[0] < extent[0] and window[1] < extent[1] and window[2] > extent[2] and window[3] > extent[3]
+        gdf = gpd.read_file(in_fp, bbox=window, fid_as_index=True)
+        geom_list, kept, _ = clean_geoms(gdf.geometry.values)
+        fids = gdf.index.to_numpy()[kept]
+        bounds = shapely.bounds(geom_list).reshape(-1, 4)
+        groups = feature_groups(geom_list, group)
+        owned, complete = [], True
+
+        for ids in groups:
+            anchor = ids[np.argmin(fids[ids])]
+            x, y = (bounds[anchor, 0] + bounds[anchor, 2]) / 2, (bounds[anchor, 1] + bounds[anchor, 3]) / 2
+
+            if tile[0] <= x < tile[2] and tile[1] <= y < tile[3]:
+                owned.append(ids)
+                complete &= covered or bool(np.all((bounds[ids, :2] > window[:2]) & (bounds[ids, 2:] < window[2:])))
+
+        if complete:
+            break
+
+        halo *= 2
+
+    poly_list, poly_source = prepare_groups(geom_list, simplify=simplify, groups=owned)
+    records = list(regularize_groups(poly_list, poly_source, lod=lod, criterion=criterion, **options))
+    src_ids = [fids[i] for ids in owned for i in ids]
+    anchors = [fids[ids].min() for ids in owned for i in ids]
+    out_gdf = records_to_gdf(records, gdf.crs)
+    out_gdf.insert(0, 'Src_ID', np.array(src_ids, dtype=np.int64))
+    out_gdf.insert(1, 'Anchor', np.array(anchors, dtype=np.int64))
+    return out_gdf.drop(columns=['Poly_ID', 'Group_ID'])
+
+
+def merge_tiles(tile_fps, in_fp, out_fp=None):
+    tiles = [gpd.read_file(fp) for fp in tile_fps]
+    tiles = [item for item in tiles if len(item)]
+    gdf = pyogrio.read_dataframe(in_fp, columns=[], fid_as_index=True)
+    _, kept, dropped = clean_geoms(gdf.geometry.values)
+    fids = gdf.index.to_numpy()[kept]
+
+    if tiles:
+        out_gdf = pd.concat(tiles, ignore_index=True).sort_values(['Anchor', 'Src_ID'], kind='stable')
+    else:
+        out_gdf = records_to_gdf([]).assign(Src_ID=[], Anchor=[])
+
+    duplicate = out_gdf['Src_ID'][out_gdf['Src_ID'].duplicated()].unique()
+    missing = np.setdiff1d(fids, out_gdf['Src_ID'].to_numpy())
+
+    if len(duplicate) or len(missing):
+        raise ValueError(f'Tile results do not cover the input exactly once: '
+                         f'{len(duplicate)} duplicated and {len(missing)} missing features')
+
+    out_gdf.insert(0, 'Poly_ID', np.arange(len(out_gdf)))
+    out_gdf.insert(1, 'Group_ID', np.unique(out_gdf['Anchor'].to_numpy(), return_inverse=True)[1])
+    out_gdf = gpd.GeoDataFrame(out_gdf[COLUMNS + ['geometry']].reset_index(drop=True), crs=out_gdf.crs)
+    out_gdf.attrs['dropped'] = dropped
+
+    if out_fp:
+        write_dataset(out_gdf, out_fp)
+
+    return out_gdf
+
+
+def regularize_tiles(in_fp, out_fp, tile_size, halo=100.0, tile_dir=None, **options):
+    tile_dir = os.path.splitext(out_fp)[0] + '_tiles' if tile_dir is None else tile_dir
+    os.makedirs(tile_dir, exist_ok=True)
+    tile_fps = []
+    require_ogr(in_fp)
+    extent = dataset_extent(in_fp)
+
+    for k, tile in enumerate(partition_tiles(in_fp, tile_size, extent)):
+        tile_gdf = regularize_tile(in_fp, tile, halo=halo, extent=extent, **options)
+
+        if len(tile_gdf):
+            tile_fps.append(os.path.join(tile_dir, f'tile_{k}.gpkg'))
+            tile_gdf.to_file(tile_fps[-1])
+
+    return merge_tiles(tile_fps, in_fp, out_fp)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Regularize building boundaries without the GUI.')
+    parser.add_argument('input', help='input file of building polygons, .parquet and .arrow/.feather are read as '
+                                      'GeoParquet and Arrow IPC')
+    parser.add_argument('output', nargs='?', help='output file (default: <input>_out.shp)')
+    parser.add_argument('--simplify', type=float, default=0.5,
+                        help='simplification threshold, no simplification while <= 0 (default: 0.5)')
+    parser.add_argument('--lod', type=int, choices=[1, 2, 3], default=1, help='level of details (default: 1)')
+    parser.add_argument('--criterion', choices=list(CRITERIA), default='Min bounding',
+                        help='regularization criterion (default: Min bounding)')
+    parser.add_argument('--separate', action='store_true', help='process touched polygons separately')
+    parser.add_argument('--sweep', choices=list(SWEEPS), default='vectorized',
+                        help='rotation sweep implementation (default: vectorized)')
+    parser.add_argument('--search', choices=SEARCHES, default='exhaustive',
+                        help='orientation search, every integer degree, refined dominant directions or every '
+                             'integer degree skipping candidates by an IOU upper bound (default: exhaustive)')
+    parser.add_argument('--peaks', type=int, default=2,
+                        help='dominant directions refined by --search refine, each aligned with every direction of '
+                             'the LOD (default: 2)')
+    parser.add_argument('--tolerance', type=float, default=2.0,
+                        help='degrees searched around each aligned dominant direction (default: 2.0)')
+    parser.add_argument('--precision', type=float, default=0.1,
+                        help='finest angle step of --search refine in degrees (default: 0.1)')
+    parser.add_argument('--slack', type=float, default=0.0,
+                        help='IOU that --search bound may lose to skip more candidates, 0 keeps the exhaustive '
+                             'result (default: 0)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='worker processes regularizing groups in parallel, 0 for all cores (default: 1)')
+    parser.add_argument('--chunk-vertices', type=int, default=20000,
+                        help='most vertices in a chunk of groups sent to a worker (default: 20000)')
+    parser.add_argument('--cache', help='sqlite file caching the results of each group between runs')
+    parser.add_argument('--cache-size', type=float, default=1024,
+                        help='cache size in MB, least recently used groups are evicted (default: 1024)')
+    parser.add_argument('--cache-version', default='', help='cache version key, changing it invalidates the cache')
+    parser.add_argument('--chunk-size', type=int, default=0,
+                        help='stream the input in chunks of this many features and append them to the output, '
+                             'touched polygons are only grouped within a chunk (default: 0, read everything)')
+    parser.add_argument('--tile-size', type=float, default=0,
+                        help='partition the input extent into square tiles of this size, regularize each tile '
+                             'and merge the per-tile results (default: 0, no tiles)')
+    parser.add_argument('--halo', type=float, default=100.0,
+                        help='initial buffer read around each tile, grown until groups are complete (default: 100)')
+    parser.add_argument('--previous', help='output of a previous run, only groups whose features were added, removed '
+                                           'or modified since are regularized again')
+    parser.add_argument('--previous-input',
+                        help='input of the previous run, needed by --previous when it has no _manifest.csv')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='journal finished groups to <output>_journal.db so an interrupted run can be resumed')
+    parser.add_argument('--checkpoint-interval', type=float, default=30.0,
+                        help='seconds between checkpoint commits (default: 30)')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the groups journaled by an interrupted --checkpoint run with the same input and '
+                             'parameters')
+    parser.add_argument('--profile', action='store_true',
+                        help='write call counts, timers and per-group costs to <output>_profile.json')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.input):
+        parser.error(f'File not exist: {args.input}')
+
+    for fp in [args.previous, args.previous_input]:
+        if fp and not os.path.exists(fp):
+            parser.error(f'File not exist: {fp}')
+
+    if args.previous and (args.tile_size > 0 or args.chunk_size > 0):
+        parser.error('--previous cannot be combined with --tile-size or --chunk-size')
+
+    if (args.checkpoint or args.resume) and (args.previous or args.tile_size > 0 or args.chunk_size > 0):
+        parser.error('--checkpoint and --resume cannot be combined with --previous, --tile-size or --chunk-size')
+
+    root, ext = os.path.splitext(args.input)
+    out_fp = args.output if args.output else root + '_out' + ext
+
+    if (args.tile_size > 0 or args.chunk_size > 0) and any(os.path.splitext(fp)[1].lower() in ARROW_FORMATS
+                                                           for fp in [args.input, out_fp]):
+        parser.error('--tile-size and --chunk-size need OGR formats such as .shp or .gpkg')
+
+    cache = ResultCache(args.cache, int(args.cache_size * 2 ** 20), args.cache_version) if args.cache else None
+    options = dict(lod=args.lod, criterion=args.criterion, group=not args.separate, simplify=args.simplify,
+                   sweep=args.sweep, search=args.search, peaks=args.peaks, tolerance=args.tolerance,
+                   precision=args.precision, slack=args.slack, workers=args.workers,
+                   max_vertices=args.chunk_vertices, cache=cache)
+    profile = enable_profile() if args.profile else None
+    time_start = time.time()
+
+    if args.previous:
+        try:
+            out_gdf, changes = regularize_incremental(args.input, out_fp, args.previous, args.previous_input,
+                                                      **options)
+        except ValueError as error:
+            parser.error(str(error))
+
+        summary = summarize(out_gdf)
+        print(f'   Features:  {changes["unchanged"]} unchanged, {changes["new"]} new or modified, '
+              f'{changes["removed"]} removed or modified')
+        print(f'     Groups:  {changes["carried"]} carried over, {changes["recomputed"]} recomputed')
+    elif args.tile_size > 0:
+        summary = summarize(regularize_tiles(args.input, out_fp, args.tile_size, halo=args.halo, **options))
+    elif args.chunk_size > 0:
+        summary = regularize_stream(args.input, out_fp, chunk_size=args.chunk_size, **options)
+    elif args.checkpoint or args.resume:
+        journal_fp = os.path.splitext(out_fp)[0] + '_journal.db'
+
+        if args.resume and not os.path.exists(journal_fp):
+            parser.error(f'No checkpoint to resume: {journal_fp}')
+
+        try:
+            summary = summarize(regularize_dataset(args.input, out_fp, checkpoint=journal_fp, resume=args.resume,
+                                                   checkpoint_interval=args.checkpoint_interval, **options))
+        except ValueError as error:
+            parser.error(str(error))
+    else:
+        summary = summarize(regularize_dataset(args.input, out_fp, **options))
+
+    time_end = time.time()
+
+    if format_dropped(summary['dropped']):
+        print(f'       Dropped:  {format_dropped(summary["dropped"])} features')
+
+    print(f'   Polygon num:  {summary["polygons"]}')
+    stats = group_stats(summary['sizes'])
+    print(f'     Group num:  {stats["groups"]}')
+    print(f'    Singletons:  {stats["singletons"]}')
+    print(f'    Group size:  max {stats["max"]}, mean {stats["mean"]:.2f}, p99 {stats["p99"]:.1f}')
+    print(f'Processing Time: {time_end - time_start:.4f}s')
+
+    if cache is not None:
+        print(f'    Cache hits:  {cache.hits}, misses: {cache.misses}')
+        cache.close()
+
+    print(f'   IOU Max:    {summary["iou_max"]:.4f}')
+    print(f'   IOU Min:    {summary["iou_min"]:.4f}')
+    print(f'   IOU AVG:    {summary["iou_mean"]:.4f}')
+    print(f'   IOU STD:    {summary["iou_std"]:.4f}')
+    print(f'Results have been saved in: {out_fp}')
 
-        for geom in geom_list:
-            sources.append(geom_list[geom])
+    if profile is not None:
+        profile = disable_profile()
 
-            if simplify > 0:
-                results.append([geom.simplify(simplify)])
-            else:
-                results.append([geom])
+        if profile.counters['candidates']:
+            print(f'Pruned candidates: {profile.counters["pruned"]} of {profile.counters["candidates"]}')
 
-    return results, sources, len(geom_list), gdf
+        profile.write(os.path.splitext(out_fp)[0] + '_profile.json')
+        print(f'Profile has been saved in: {os.path.splitext(out_fp)[0]}_profile.json')
 
 
 if __name__ == "__main__":
-    print('Test case')
-    # in_fp = 'Data\\initial_vectorization.shp'
-
-    # plt.plot(geom_np[:, 0], geom_np[:, 1])
-    # plt.plot(geom_np_new[:, 0], geom_np_new[:, 1], marker='*')
-    # plt.plot(*item.exterior.xy)
-    # plt.show()
-
-    # geom_list, geom_num = load_shp(fp)
-    # results, IOU_final = [], []
-
-    # for geom in geom_list:
-    #     IOUs, geom_regs, degs = [], [], [item for item in range(180)]
-    #
-    #     for deg in degs:
-    #         centroid, geom_rotate = rotate_geom(geom, deg)
-    #         geom_reg, IOU = regularize_geom(geom_rotate, lod=1)
-    #         geom_reg = rotate_geom_back(geom_reg, centroid, - deg)
-    #
-    #         IOUs.append(np.mean(IOU))
-    #         geom_regs.append(geom_reg)
-    #
-    #     bid = np.argmax(IOUs)
-    #     temp = process_overlap(geom_regs[bid])
-    #     c = 1
-    #
-    #     for item in temp:
-    #         plt.plot(*item.exterior.xy)
-    #
-    #     results.append(process_overlap(geom_regs[bid]))
-    #     IOU_final.append(IOUs[bid])
-    #
-    #     c = 1
+    main()
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import stat
+import queue
+import argparse
+import threading
+import collections
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ProcessPoolExecutor
+import shapely
+import numpy as np
+from shapely.geometry import Polygon
+from bldg_regularization import (CRITERIA, SEARCHES, SWEEPS, clean_geoms, collect_chunk, criterion_alphas,
+                                 direction_vectors, feature_groups, format_dropped, prepare_groups, regularize_chunk,
+                                 regularize_group)
+
+DEFAULTS = {'lod': 1, 'criterion': 'Min bounding', 'group': True, 'simplify': 0.5, 'sweep': 'vectorized',
+            'search': 'exhaustive', 'peaks': 2, 'tolerance': 2.0, 'precision': 0.1, 'slack': 0.0}
+FORMATS = ['geojson', 'wkb']
+
+
+def warm_up():
+    square = [Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])]
+
+    for lod in [1, 2, 3]:
+        direction_vectors(lod)
+        regularize_group(square, lod=lod, alphas=CRITERIA['Min bounding'])
+
+    return os.getpid()
+
+
+def read_geometry(item):
+    return shapely.from_geojson(json.dumps(item)) if isinstance(item, dict) else shapely.from_wkb(item)
+
+
+def write_geometry(geom, fmt='geojson'):
+    return json.loads(shapely.to_geojson(geom)) if fmt == 'geojson' else shapely.to_wkb(geom, hex=True)
+
+
+class Job:
+    def __init__(self, payload):
+        unknown = set(payload) - set(DEFAULTS) - {'geometries', 'format'}
+
+        if unknown:
+            raise ValueError(f'Unknown request keys: {", ".join(sorted(unknown))}')
+
+        params = {key: payload.get(key, value) for key, value in DEFAULTS.items()}
+        self.format = payload.get('format', 'geojson')
+
+        for key, value in params.items():
+            kind = type(DEFAULTS[key])
+            types = (int, float) if kind is float else kind
+
+            if isinstance(value, bool) != (kind is bool) or not isinstance(value, types):
+                raise ValueError(f'{key} must be of type {kind.__name__}, got {value!r}')
+
+        if params['lod'] not in (1, 2, 3):
+            raise ValueError(f'lod must be 1, 2 or 3, got {params["lod"]}')
+        if params['peaks'] <= 0 or params['precision'] <= 0:
+            raise ValueError('peaks and precision must be positive')
+        if min(params['simplify'], params['tolerance'], params['slack']) < 0:
+            raise ValueError('simplify, tolerance and slack cannot be negative')
+        if self.format not in FORMATS:
+            raise ValueError(f'Unknown geometry format: {self.format}')
+        if params['sweep'] not in SWEEPS:
+            raise ValueError(f'Unknown sweep mode: {params["sweep"]}')
+        if params['search'] not in SEARCHES:
+            raise ValueError(f'Unknown search mode: {params["search"]}')
+
+        self.alphas = criterion_alphas(params.pop('criterion'))
+        group, simplify = params.pop('group'), params.pop('simplify')
+        geoms, kept, dropped = clean_geoms([read_geometry(item) for item in payload['geometries']])
+
+        if len(kept) < len(payload['geometries']):
+            raise ValueError(f'Only polygons with an area can be regularized, got {format_dropped(dropped)} features')
+
+        self.groups = feature_groups(geoms, group)
+        self.poly_list = prepare_groups(geoms, simplify=simplify, groups=self.groups)[0]
+        self.params, self.key = params, json.dumps([params, self.alphas], sort_keys=True)
+        self.done, self.results, self.error = threading.Event(), [], None
+
+    def response(self):
+        items = [None] * sum(len(ids) for ids in self.groups)
+
+        for group_id, (ids, (poly_clean, IOUs, deg, factors)) in enumerate(zip(self.groups, self.results)):
+            for i, geom, value, factor in zip(ids, poly_clean, IOUs, factors):
+                items[i] = {'geometry': write_geometry(geom, self.format), 'Group_ID': group_id, 'IOU': float(value),
+                            'Direction': float(deg), 'Factor': float(factor)}
+
+        return {'results': items}
+
+
+class Service:
+    def __init__(self, workers=1, batch=64, batch_wait=0.002, queue_size=256):
+        self.workers, self.batch, self.batch_wait = workers, batch, batch_wait
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers > 0 else None
+
+        if self.executor is None:
+            warm_up()
+        else:
+            for future in [self.executor.submit(warm_up) for _ in range(workers)]:
+                future.result()
+
+        self.thread = threading.Thread(target=self.dispatch, daemon=True)
+        self.thread.start()
+
+    def submit(self, payload):
+        job = Job(payload)
+
+        if job.poly_list:
+            self.jobs.put_nowait(job)
+            job.done.wait()
+
+        if job.error is not None:
+            raise job.error
+
+        return job.response()
+
+    def handle(self, data):
+        try:
+            return 200, self.submit(json.loads(data))
+        except queue.Full:
+            return 503, {'error': 'The request queue is full, retry later'}
+        except (ValueError, KeyError, TypeError, shapely.errors.GEOSException) as error:
+            return 400, {'error': str(error)}
+        except Exception as error:
+            return 500, {'error': str(error)}
+
+    def dispatch(self):
+        while True:
+            jobs = [self.jobs.get()]
+            deadline = time.monotonic() + self.batch_wait
+
+            while len(jobs) < self.batch:
+                try:
+                    jobs.append(self.jobs.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            batches = collections.defaultdict(list)
+
+            for job in jobs:
+                batches[job.key].append(job)
+
+            for items in batches.values():
+                self.run(items)
+
+    def run(self, jobs):
+        alphas, params = jobs[0].alphas, jobs[0].params
+        poly_list = [poly for job in jobs for poly in job.poly_list]
+
+        try:
+            if self.executor is None:
+                results = [regularize_group(poly, alphas=alphas, **params) for poly in poly_list]
+            else:
+                chunks = np.array_split(np.arange(len(poly_list)), min(self.workers, len(poly_list)))
+                futures = [self.executor.submit(regularize_chunk, [shapely.to_wkb(poly_list[i]) for i in ids],
+                                                alphas=alphas, **params) for ids in chunks]
+                results = [result for future in futures for result, _ in collect_chunk(future)]
+        except Exception as error:
+            if len(jobs) > 1:
+                for job in jobs:
+                    self.run([job])
+                return
+
+            results, jobs[0].error = None, error
+
+        start = 0
+
+        for job in jobs:
+            if results is not None:
+                job.results = results[start:start + len(job.poly_list)]
+                start += len(job.poly_list)
+
+            job.done.set()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.reply(200, {'status': 'ok', 'queued': self.server.service.jobs.qsize()})
+
+    def do_POST(self):
+        self.reply(*self.server.service.handle(self.rfile.read(int(self.headers.get('Content-Length', 0)))))
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class LineHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if line.strip():
+                status, body = self.server.service.handle(line)
+                self.wfile.write(json.dumps({'status': status, **body}).encode() + b'\n')
+                self.wfile.flush()
+
+
+class HTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128
+
+
+class UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads, request_queue_size = True, 128
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve building regularization requests from warm workers.')
+    parser.add_argument('--host', default='127.0.0.1', help='HTTP host (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='HTTP port (default: 8765)')
+    parser.add_argument('--socket', help='serve JSON lines on this Unix socket instead of HTTP')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='warm worker processes, 0 regularizes in the service process (default: 1)')
+    parser.add_argument('--batch', type=int, default=64, help='most requests regularized together (default: 64)')
+    parser.add_argument('--batch-wait', type=float, default=2.0,
+                        help='milliseconds to wait for more requests of a batch (default: 2)')
+    parser.add_argument('--queue-size', type=int, default=256,
+                        help='pending requests before new ones are rejected with status 503 (default: 256)')
+    args = parser.parse_args(argv)
+
+    if args.socket and os.path.exists(args.socket):
+        if not stat.S_ISSOCK(os.stat(args.socket).st_mode):
+            parser.error(f'--socket is an existing file that is not a socket: {args.socket}')
+
+        os.remove(args.socket)
+
+    service = Service(args.workers, args.batch, args.batch_wait / 1000, args.queue_size)
+
+    if args.socket:
+        server = UnixServer(args.socket, LineHandler)
+        address = args.socket
+    else:
+        server = HTTPServer((args.host, args.port), HTTPHandler)
+        address = f'http://{args.host}:{server.server_address[1]}'
+
+    server.service = service
+    print(f'Regularization service is listening on {address}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
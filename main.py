@@ -1,12 +1,17 @@
 import os
 import time
-import pandas as pd
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk
 import tkinter.filedialog
 import tkinter.scrolledtext
+import matplotlib.pyplot as plt
 from bldg_regularization import *
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.collections import LineCollection
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+
+LAYERS = {'source': 'r', 'simplified': 'b', 'regularized': 'g'}
 
 
 class App(tk.Tk):
@@ -16,6 +21,9 @@ class App(tk.Tk):
         self.in_fp, self.out_fp = None, None
         self.poly_source, self.poly_out, self.poly_in, self.poly_ids = None, None, None, None
         self.IOU_final, self.group_ids, self.direction, self.factor = None, None, None, None
+        self.queue, self.worker, self.cancel_event = queue.Queue(), None, threading.Event()
+        self.rows, self.table_limit, self.poly_num, self.time_start = [], 500, 0, 0
+        self.layers, self.collections, self.view_all, self.redraw_id = None, [], False, None
 
         # App Frames
         self.setting_frame = tk.LabelFrame(self, text="Setting View")
@@ -75,11 +83,17 @@ class App(tk.Tk):
         self.view_btn.grid(row=6, column=1, sticky="ew", padx=5, pady=5)
 
         self.process_bar = ttk.Progressbar(self.setting_frame, mode='determinate')
-        self.process_bar.grid(row=7, column=0, columnspan=2, sticky="ew", padx=5, pady=5)
+        self.process_bar.grid(row=7, column=0, sticky="ew", padx=5, pady=5)
+
+        self.cancel_btn = tk.Button(self.setting_frame, text='Cancel', state='disabled', command=self.cancel)
+        self.cancel_btn.grid(row=7, column=1, sticky="ew", padx=5, pady=5)
+
+        self.status_label = tk.Label(self.setting_frame, text='')
+        self.status_label.grid(row=8, column=0, columnspan=2, sticky="ew", padx=5, pady=5)
 
         self.text_area = tk.scrolledtext.ScrolledText(self.setting_frame, wrap=tk.WORD, width=40, height=10,
                                                       state='disabled')
-        self.text_area.grid(row=8, column=0, columnspan=2, sticky="ewn", padx=5, pady=5)
+        self.text_area.grid(row=9, column=0, columnspan=2, sticky="ewn", padx=5, pady=5)
         self.write_log('**********Polygon Regularization**********\n')
         self.write_log(f'Date: {time.ctime()}\n')
         self.write_log('Please select the shapefile...\n')
@@ -101,20 +115,23 @@ class App(tk.Tk):
 
         self.table_scroll = ttk.Scrollbar(self.table_frame, orient="vertical", command=self.table_view.yview)
         self.table_scroll.grid(row=0, column=1, sticky="ns")
-        self.table_view.configure(yscrollcommand=self.table_scroll.set)
+        self.table_view.configure(yscrollcommand=self.scroll_table)
 
         # Display frame
         self.source_flag = tk.BooleanVar()
-        self.source_check = tk.Checkbutton(self.display_frame, text='Source', variable=self.source_flag, fg='red')
+        self.source_check = tk.Checkbutton(self.display_frame, text='Source', variable=self.source_flag, fg='red',
+                                           command=self.schedule_view)
         self.source_check.grid(row=0, column=0, sticky="n", padx=25, pady=5)
 
         self.simple_flag = tk.BooleanVar()
-        self.simple_check = tk.Checkbutton(self.display_frame, text='Simplified', variable=self.simple_flag, fg='blue')
+        self.simple_check = tk.Checkbutton(self.display_frame, text='Simplified', variable=self.simple_flag, fg='blue',
+                                           command=self.schedule_view)
         self.simple_check.select()
         self.simple_check.grid(row=0, column=1, sticky="n", padx=25, pady=5)
 
         self.out_flag = tk.BooleanVar()
-        self.out_check = tk.Checkbutton(self.display_frame, text='Regularized', variable=self.out_flag, fg='green')
+        self.out_check = tk.Checkbutton(self.display_frame, text='Regularized', variable=self.out_flag, fg='green',
+                                        command=self.schedule_view)
         self.out_check.select()
         self.out_check.grid(row=0, column=2, sticky="n", padx=25, pady=5)
 
@@ -127,12 +144,17 @@ class App(tk.Tk):
         self.plot_canvas = FigureCanvasTkAgg(fig, master=self.display_frame)
         self.plot_canvas.draw()
         self.plot_canvas.get_tk_widget().grid(row=1, column=0, columnspan=3, sticky="nsew", padx=5, pady=5)
+        self.plot_canvas.mpl_connect('scroll_event', self.zoom)
+
+        self.toolbar = NavigationToolbar2Tk(self.plot_canvas, self.display_frame, pack_toolbar=False)
+        self.toolbar.grid(row=2, column=0, columnspan=3, sticky="ew", padx=5, pady=5)
 
         App.resizable(self, width=0, height=0)
 
     def open_file(self):
         self.in_fp = tk.filedialog.askopenfilename(title="Select file for processing",
-                                                   filetypes=(("Shapefiles", "*.shp"), ("all files", "*.*")))
+                                                   filetypes=(("Shapefiles", "*.shp"), ("GeoParquet", "*.parquet"),
+                                                              ("Arrow IPC", "*.arrow *.feather"), ("all files", "*.*")))
 
         self.open_file_text.delete(0, "end")
         self.open_file_text.insert(0, self.in_fp)
@@ -166,6 +188,7 @@ class App(tk.Tk):
             self.simple_text.insert(0, '0.5')
 
     def draw_one(self, event):
+        self.view_all = False
         self.ax.clear()
         self.ax.axis('off')
         idx = self.table_view.index(self.table_view.selection()[0])
@@ -185,20 +208,73 @@ class App(tk.Tk):
         self.update()
 
     def draw_all(self):
+        self.view_all = True
         self.ax.clear()
         self.ax.axis('off')
         self.ax.set_title(f'Visualization of All Polygons', y=0.95)
+        self.collections = []
 
-        for i in range(len(self.poly_in)):
-            if self.source_flag.get():
-                self.ax.plot(*self.poly_source[i].exterior.xy, 'r-')
-            if self.simple_flag.get():
-                self.ax.plot(*self.poly_in[i].exterior.xy, 'b-')
-            if self.out_flag.get():
-                self.ax.plot(*self.poly_out[i].exterior.xy, 'g-')
+        if self.layers is None or self.layers['count'] != len(self.poly_out):
+            self.build_layers()
 
-        self.plot_canvas.draw()
-        self.update()
+        minx, miny, maxx, maxy = shapely.total_bounds(np.concatenate([self.layers[name][0] for name in LAYERS]))
+        self.ax.set_xlim(minx, maxx)
+        self.ax.set_ylim(miny, maxy)
+        self.ax.callbacks.connect('xlim_changed', self.schedule_view)
+        self.ax.callbacks.connect('ylim_changed', self.schedule_view)
+        self.toolbar.update()
+        self.draw_view()
+
+    def build_layers(self):
+        self.layers = {'count': len(self.poly_out)}
+
+        for name, geoms in zip(LAYERS, [self.poly_source, self.poly_in, self.poly_out]):
+            parts = shapely.get_parts(np.array(geoms, dtype=object))
+            self.layers[name] = (parts, shapely.STRtree(parts), shapely.bounds(parts))
+
+    def visible_rings(self, name, xlim, ylim, pixel):
+        parts, tree, bounds = self.layers[name]
+        ids = np.sort(tree.query(shapely.box(xlim[0], ylim[0], xlim[1], ylim[1])))
+        ids = ids[np.maximum(bounds[ids, 2] - bounds[ids, 0], bounds[ids, 3] - bounds[ids, 1]) >= pixel]
+        rings = shapely.simplify(shapely.get_exterior_ring(parts[ids]), pixel / 2)
+        coords, index = shapely.get_coordinates(rings, return_index=True)
+        return np.split(coords, np.flatnonzero(np.diff(index)) + 1) if len(coords) else []
+
+    def schedule_view(self, *args):
+        if self.redraw_id is None:
+            self.redraw_id = self.after(50, self.draw_view)
+
+    def draw_view(self):
+        self.redraw_id = None
+
+        if not self.view_all or self.layers is None:
+            return
+
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        pixel = (xlim[1] - xlim[0]) / max(self.ax.bbox.width, 1)
+
+        for collection in self.collections:
+            collection.remove()
+
+        self.collections = []
+
+        for name, flag in zip(LAYERS, [self.source_flag, self.simple_flag, self.out_flag]):
+            if flag.get():
+                collection = LineCollection(self.visible_rings(name, xlim, ylim, pixel), colors=LAYERS[name])
+                self.ax.add_collection(collection, autolim=False)
+                self.collections.append(collection)
+
+        self.plot_canvas.draw_idle()
+
+    def zoom(self, event):
+        if event.inaxes is not self.ax:
+            return
+
+        scale = 1 / 1.25 if event.button == 'up' else 1.25
+        xlim, ylim = self.ax.get_xlim(), self.ax.get_ylim()
+        self.ax.set_xlim(event.xdata - (event.xdata - xlim[0]) * scale, event.xdata + (xlim[1] - event.xdata) * scale)
+        self.ax.set_ylim(event.ydata - (event.ydata - ylim[0]) * scale, event.ydata + (ylim[1] - event.ydata) * scale)
+        self.plot_canvas.draw_idle()
 
     def write_log(self, s):
         self.text_area.configure(state='normal')
@@ -206,11 +282,29 @@ class App(tk.Tk):
         self.text_area.configure(state='disabled')
         self.text_area.see('end')
 
+    def scroll_table(self, first, last):
+        self.table_scroll.set(first, last)
+
+        if float(last) > 0.95 and self.table_limit < len(self.rows):
+            self.table_limit += 500
+            self.fill_table()
+
+    def fill_table(self):
+        for i in range(len(self.table_view.get_children()), min(self.table_limit, len(self.rows))):
+            poly_id, values = self.rows[i]
+            self.table_view.insert('', 'end', text=poly_id, values=values)
+
+    def cancel(self):
+        self.cancel_event.set()
+        self.cancel_btn.configure(state='disabled')
+
     def process(self):
+        if self.worker is not None and self.worker.is_alive():
+            return
+
         self.ax.clear()
         self.ax.axis('off')
         self.plot_canvas.draw()
-        self.update()
 
         fp = self.open_file_text.get()
         simple_th = float(self.simple_text.get())
@@ -218,15 +312,16 @@ class App(tk.Tk):
         criterion = self.RC_combox.get()
         group = self.TP_combox.get()
         group_flag = True if group == 'Group' else False
-        alphas = [0] if criterion == 'Min bounding' else [0.3, 0.35, 0.4, 0.45, 0.5, 0.55, 0.6, 0.65, 0.7]
 
         for row in self.table_view.get_children():
             self.table_view.delete(row)
 
         if os.path.exists(fp):
-            time_start = time.time()
-            poly_out, poly_in, IOU_final, poly_ids, group_ids, direction, factor = [], [], [], [], [], [], []
-            poly_id, group_id = 0, 0
+            self.time_start = time.time()
+            self.poly_source, self.poly_out, self.poly_in, self.poly_ids = [], [], [], []
+            self.IOU_final, self.group_ids, self.direction, self.factor = [], [], [], []
+            self.rows, self.table_limit, self.poly_num = [], 500, 0
+            self.layers, self.view_all = None, False
             self.write_log(' ' * 40 + '\n')
             self.write_log(f'File path:  {fp}\n')
             self.write_log(f'Threshold:  {simple_th}\n')
@@ -236,101 +331,139 @@ class App(tk.Tk):
             self.write_log(' ' * 40 + '\n')
             self.write_log(f'Loading shapefile...\n')
 
+            self.cancel_event.clear()
+            self.run_btn.configure(state='disabled')
+            self.view_btn.configure(state='disabled')
+            self.cancel_btn.configure(state='normal')
+            self.worker = threading.Thread(target=self.run_worker, daemon=True,
+                                           args=(fp, self.out_fp, simple_th, lod, criterion, group_flag))
+            self.worker.start()
+            self.after(100, self.poll_worker)
+        else:
+            self.write_log(' ' * 40 + '\n')
+            self.write_log('File not exist, please retry...')
+            self.finish()
+
+    def run_worker(self, fp, out_fp, simple_th, lod, criterion, group_flag):
+        try:
             poly_list, poly_source, poly_num, gdf = load_shp(fp, group_flag, simple_th)
-            self.write_log(f'   Polygon num:  {poly_num}\n')
-            self.update()
+            self.queue.put(('loaded', poly_num, len(poly_list), group_stats([len(poly) for poly in poly_list]),
+                            gdf.attrs['dropped']))
+            records, batch, time_put = [], [], time.time()
+            results = regularize_groups(poly_list, poly_source, lod=lod, criterion=criterion)
 
-            if group_flag:
-                self.write_log(f'     Group num:  {len(poly_list)}\n')
+            for record in results:
+                records.append(record)
+                batch.append(record)
 
-            self.write_log(' ' * 40 + '\n')
-            self.write_log(f'Start regularizing polygons...\n')
-            self.write_log(' ' * 40 + '\n')
+                if self.cancel_event.is_set():
+                    results.close()
+                    self.queue.put(('cancelled',))
+                    return
 
-            for poly in poly_list:
-                IOUs, poly_regs, alpha_temp, degs = [], [], [], [item for item in range(180)]
-                centroid = [shapely.centroid(item) for item in poly]
-
-                for deg in degs:
-                    poly_rotate = rotate_geom(poly, centroid, deg)
-                    poly_reg, IOU, alpha = regularize_geom(poly_rotate, lod=lod, alphas=alphas)
-                    poly_reg = rotate_geom(poly_reg, centroid, - deg)
-
-                    IOUs.append(np.mean(IOU))
-                    poly_regs.append(poly_reg)
-                    alpha_temp.append(alpha)
-
-                bid = np.argmax(IOUs)
-                poly_clean = process_overlap(poly_regs[bid])
-
-                for i in range(len(poly)):
-                    poly_in.append(poly[i])
-                    poly_out.append(poly_clean[i])
-                    IOU = poly[i].intersection(poly_clean[i]).area / poly[i].union(poly_clean[i]).area
-                    IOU_final.append(IOU)
-                    poly_ids.append(poly_id)
-                    group_ids.append(group_id)
-                    direction.append(degs[bid])
-                    factor_best = alpha_temp[bid][i]
-                    factor.append(factor_best)
-
-                    self.process_bar['value'] = int(100 * poly_id / poly_num)
-                    self.table_view.insert('', 'end', text=f'{poly_id}',
-                                           values=[f'{group_id}', f'{IOU:.4f}',
-                                                   f'{degs[bid]}°', f'{1 - factor_best:.2f}'])
-                    poly_id += 1
-                    self.update()
-                group_id += 1
-
-            df = pd.DataFrame({
-                'Poly_ID': poly_ids,
-                'Group_ID': group_ids,
-                'IOU': IOU_final,
-                'Direction': direction,
-                'Factor': factor
-            })
+                if time.time() - time_put > 0.2:
+                    self.queue.put(('records', batch))
+                    batch, time_put = [], time.time()
 
+            self.queue.put(('records', batch))
             time_end = time.time()
-            self.write_log(f'Processing Time: {time_end - time_start:.4f}s\n')
-
-            if not gdf.crs:
-                out_gdf = gpd.GeoDataFrame(df, geometry=poly_out, crs='')
-                self.write_log('No CRS found.\n')
-            else:
-                out_gdf = gpd.GeoDataFrame(df, geometry=poly_out, crs=gdf.crs.to_epsg())
-                self.write_log(f'CRS: {gdf.crs.to_epsg()}.\n')
-
-            self.poly_source = poly_source
-            self.poly_out = poly_out
-            self.poly_in = poly_in
-            self.IOU_final = IOU_final
-            self.poly_ids = poly_ids
-            self.group_ids = group_ids
-            self.direction = direction
-            self.factor = factor
-            self.process_bar['value'] = 0
+            write_dataset(records_to_gdf(records, gdf.crs), out_fp)
+            self.queue.put(('done', time_end - self.time_start, gdf.crs.to_epsg() if gdf.crs else None, out_fp))
+        except Exception as e:
+            self.queue.put(('error', f'{type(e).__name__}: {e}'))
+
+    def poll_worker(self):
+        while True:
+            try:
+                message = self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if message[0] == 'loaded':
+                self.poly_num = message[1]
+
+                if format_dropped(message[4]):
+                    self.write_log(f'       Dropped:  {format_dropped(message[4])} features\n')
+
+                self.write_log(f'   Polygon num:  {message[1]}\n')
+
+                if self.TP_combox.get() == 'Group':
+                    self.write_log(f'     Group num:  {message[2]}\n')
+                    self.write_log(f'    Group size:  max {message[3]["max"]}\n')
+
+                self.write_log(' ' * 40 + '\n')
+                self.write_log(f'Start regularizing polygons...\n')
+                self.write_log(' ' * 40 + '\n')
+            elif message[0] == 'records':
+                self.add_records(message[1])
+            elif message[0] == 'done':
+                self.complete(*message[1:])
+                return
+            elif message[0] == 'cancelled':
+                self.write_log(' ' * 40 + '\n')
+                self.write_log(f'Cancelled after {len(self.rows)} polygons.\n')
+                self.finish()
+                return
+            elif message[0] == 'error':
+                self.write_log(' ' * 40 + '\n')
+                self.write_log(f'Failed: {message[1]}\n')
+                self.finish()
+                return
+
+        self.after(100, self.poll_worker)
+
+    def add_records(self, records):
+        for record in records:
+            poly_id, group_id, IOU = record['Poly_ID'], record['Group_ID'], record['IOU']
+            self.poly_source.append(record['source'])
+            self.poly_in.append(record['simplified'])
+            self.poly_out.append(record['geometry'])
+            self.IOU_final.append(IOU)
+            self.poly_ids.append(poly_id)
+            self.group_ids.append(group_id)
+            self.direction.append(record['Direction'])
+            self.factor.append(record['Factor'])
+            self.rows.append((f'{poly_id}', [f'{group_id}', f'{IOU:.4f}', f'{record["Direction"]}°',
+                                             f'{1 - record["Factor"]:.2f}']))
+
+        self.fill_table()
+        done, elapsed = len(self.rows), time.time() - self.time_start
+        rate = done / elapsed if elapsed > 0 else 0
+        eta = (self.poly_num - done) / rate if rate > 0 else 0
+        self.process_bar['value'] = int(100 * done / self.poly_num) if self.poly_num else 0
+        self.status_label.configure(text=f'{done}/{self.poly_num} polygons, {rate:.1f} poly/s, ETA {eta:.0f}s')
+
+    def complete(self, elapsed, epsg, out_fp):
+        self.write_log(f'Processing Time: {elapsed:.4f}s\n')
+
+        if epsg is None:
+            self.write_log('No CRS found.\n')
+        else:
+            self.write_log(f'CRS: {epsg}.\n')
 
+        if self.IOU_final:
             self.write_log(' ' * 40 + '\n')
             self.write_log('Statistic:\n')
-            self.write_log(f'   IOU Max:    {np.max(IOU_final):.4f}\n')
-            self.write_log(f'   IOU Min:    {np.min(IOU_final):.4f}\n')
-            self.write_log(f'   IOU AVG:    {np.mean(IOU_final):.4f}\n')
-            self.write_log(f'   IOU STD:    {np.std(IOU_final):.4f}\n')
-            self.write_log(' ' * 40 + '\n')
-            self.write_log(f'Done!\nPress View button to display the results, or doubleclick table to display one.\n')
-            self.write_log(' ' * 40 + '\n')
-            out_gdf.to_file(self.out_fp)
-            self.write_log(f'Results have been saved in: {self.out_fp}\n')
-            self.view_btn.configure(state='normal')
-        else:
-            self.write_log(' ' * 40 + '\n')
-            self.write_log('File not exist, please retry...')
+            self.write_log(f'   IOU Max:    {np.max(self.IOU_final):.4f}\n')
+            self.write_log(f'   IOU Min:    {np.min(self.IOU_final):.4f}\n')
+            self.write_log(f'   IOU AVG:    {np.mean(self.IOU_final):.4f}\n')
+            self.write_log(f'   IOU STD:    {np.std(self.IOU_final):.4f}\n')
 
+        self.write_log(' ' * 40 + '\n')
+        self.write_log(f'Done!\nPress View button to display the results, or doubleclick table to display one.\n')
+        self.write_log(' ' * 40 + '\n')
+        self.write_log(f'Results have been saved in: {out_fp}\n')
+        self.view_btn.configure(state='normal')
+        self.finish()
+
+    def finish(self):
+        self.process_bar['value'] = 0
+        self.run_btn.configure(state='normal')
+        self.cancel_btn.configure(state='disabled')
         self.write_log(' ' * 40 + '\n')
         self.write_log('**********Polygon Regularization**********\n')
         self.write_log(f'Date: {time.ctime()}\n')
         self.write_log('Please select the shapefile...\n')
-        self.update()
 
 
 if __name__ == "__main__":
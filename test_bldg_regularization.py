@@ -0,0 +1,126 @@
+import os
+import numpy as np
+import shapely
+import pytest
+import geopandas as gpd
+import bldg_regularization as br
+from benchmark import synthetic_footprints
+from bldg_cache import ResultCache
+from bldg_regularization import (CRITERIA, iou, load_shp, previous_hashes, regularize_dataset,
+                                 regularize_incremental, search_group)
+
+
+def assert_same(out_gdf, expected):
+    assert out_gdf.drop(columns='geometry').equals(expected.drop(columns='geometry'))
+    assert out_gdf.geometry.geom_equals_exact(expected.geometry, 0).all()
+
+
+@pytest.fixture(scope='module')
+def footprints(tmp_path_factory):
+    fp = str(tmp_path_factory.mktemp('data') / 'footprints.gpkg')
+    gpd.GeoDataFrame(geometry=synthetic_footprints(40, seed=3), crs=3857).to_file(fp)
+    return fp
+
+
+@pytest.fixture(scope='module')
+def expected(footprints):
+    return regularize_dataset(footprints)
+
+
+@pytest.mark.parametrize('lod', [1, 2, 3])
+@pytest.mark.parametrize('criterion', list(CRITERIA))
+def test_searches_match_shapely_sweep(footprints, lod, criterion):
+    alphas = CRITERIA[criterion]
+
+    for poly in load_shp(footprints)[0][:8]:
+        reference = search_group(poly, lod=lod, alphas=alphas, sweep='shapely')
+        poly_reg, deg, factors, value = search_group(poly, lod=lod, alphas=alphas)
+        bound = search_group(poly, lod=lod, alphas=alphas, search='bound')
+
+        # angles that tie within IOU_TOL, e.g. 90 degrees apart, may be resolved differently by the Shapely sweep
+        assert value == pytest.approx(reference[3], abs=1e-9)
+        np.testing.assert_allclose(iou(poly_reg, poly), iou(reference[0], poly), atol=1e-9)
+        assert (bound[1], bound[2], bound[3]) == (deg, factors, value)
+        assert list(shapely.to_wkb(bound[0])) == list(shapely.to_wkb(poly_reg))
+
+
+def test_cache_round_trip(footprints, expected, tmp_path):
+    with ResultCache(str(tmp_path / 'cache.db')) as cache:
+        assert_same(regularize_dataset(footprints, cache=cache), expected)
+        groups = cache.misses
+
+    with ResultCache(str(tmp_path / 'cache.db')) as cache:
+        assert_same(regularize_dataset(footprints, cache=cache), expected)
+        assert (cache.hits, cache.misses) == (groups, 0)
+
+
+def test_cache_eviction_keeps_results_in_order(footprints, tmp_path):
+    with ResultCache(str(tmp_path / 'cache.db')) as cache:
+        regularize_dataset(footprints, cache=cache)
+        size = cache.size
+        cache.conn.execute('UPDATE results SET used = (SELECT 2 * MIN(used) FROM results) - used')
+
+    gdf = gpd.read_file(footprints)
+    half = gdf.index[:len(gdf) // 2]
+    gdf.loc[half, 'geometry'] = [shapely.affinity.translate(geom, 0.25, 0.25) for geom in gdf.geometry[half]]
+    changed_fp = str(tmp_path / 'changed.gpkg')
+    gdf.to_file(changed_fp)
+
+    with ResultCache(str(tmp_path / 'cache.db'), size) as cache:
+        assert_same(regularize_dataset(changed_fp, cache=cache), regularize_dataset(changed_fp))
+
+
+def test_resume_matches_full_run(footprints, expected, tmp_path, monkeypatch):
+    regularize_group, calls = br.regularize_group, []
+
+    def interrupted(*args, **kwargs):
+        if len(calls) == 10:
+            raise RuntimeError('interrupted')
+
+        calls.append(args)
+        return regularize_group(*args, **kwargs)
+
+    journal_fp = str(tmp_path / 'journal.db')
+    monkeypatch.setattr(br, 'regularize_group', interrupted)
+
+    with pytest.raises(RuntimeError):
+        regularize_dataset(footprints, checkpoint=journal_fp, checkpoint_interval=0)
+
+    monkeypatch.undo()
+
+    with pytest.raises(ValueError, match='changed'):
+        regularize_dataset(footprints, lod=2, checkpoint=journal_fp, resume=True)
+
+    br.enable_profile()
+
+    try:
+        assert_same(regularize_dataset(footprints, checkpoint=journal_fp, resume=True), expected)
+    finally:
+        profile = br.disable_profile()
+
+    assert sum(group['source'] == 'journal' for group in profile.groups) == 10
+    assert not os.path.exists(journal_fp)
+
+
+def test_incremental_matches_full_run(footprints, tmp_path):
+    gdf = gpd.read_file(footprints)
+    gdf = gdf.drop(index=[3, 17]).reset_index(drop=True)
+    gdf.loc[5, 'geometry'] = shapely.affinity.translate(gdf.geometry[5], 0.5, 0)
+    changed_fp, previous_fp = str(tmp_path / 'changed.gpkg'), str(tmp_path / 'previous.gpkg')
+    incremental_fp, full_fp = str(tmp_path / 'incremental.gpkg'), str(tmp_path / 'full.gpkg')
+    gdf.to_file(changed_fp)
+
+    regularize_dataset(footprints, previous_fp)
+    incremental, stats = regularize_incremental(changed_fp, incremental_fp, previous_fp, footprints)
+    full = regularize_dataset(changed_fp, full_fp)
+    assert stats['carried'] > 0 and stats['recomputed'] > 0
+
+    incremental['Hash'] = incremental['Poly_ID'].map(previous_hashes(incremental_fp))
+    full['Hash'] = full['Poly_ID'].map(previous_hashes(full_fp, changed_fp))
+    merged = incremental.merge(full, on='Hash')
+    assert len(merged) == len(incremental) == len(full)
+
+    for column in ['IOU', 'Direction', 'Factor']:
+        np.testing.assert_array_equal(merged[f'{column}_x'], merged[f'{column}_y'])
+
+    assert shapely.equals_exact(merged['geometry_x'].values, merged['geometry_y'].values, 0).all()